@@ -0,0 +1,187 @@
+"""Emission trends per user: period-over-period deltas, rolling averages and
+per-activity-type slopes.
+
+For each user, as of a day (default today), user_trends() reports:
+
+    last_7_days, previous_7_days      emission in the trailing 7 days and the 7 before
+    wow_delta, wow_percent            week-over-week change (percent is None from zero)
+    last_30_days, previous_30_days    the same over 30-day windows
+    mom_delta, mom_percent            month-over-month change
+    rolling_7_day_avg                 mean daily emission over the trailing 7 days
+    rolling_30_day_avg                ... and 30 days
+    type_slopes                       {activity_type: least-squares slope of daily
+                                      emission over the last ANALYTICS_TREND_DAYS
+                                      days, in kg CO2/day per day}
+
+Every user is computed in one pass over one query: emissions_daily rows in
+the window, with each row's age in days computed by the database (so no
+dates are parsed in Python). Databases without the rollup table fall back
+to the same query grouped by day over activities. Days without activity
+count as zero, which lets the slope be summed from the rows present. With
+NumPy installed the pass is vectorised with bincount; otherwise it is a
+plain loop.
+
+Results for given users are cached in cache.aggregate_cache per user data
+version, so a write only recomputes the users it touched; the all-users
+result is cached as a whole until the next write.
+"""
+import os
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from sqlalchemy import Integer, cast, func, inspect, literal, select
+from sqlalchemy.orm import Session
+from cache import aggregate_cache
+from models import Activity, EmissionDaily, User, session_scope
+from rollups import day_of
+from utils import get_numpy
+
+TREND_DAYS = int(os.getenv("ANALYTICS_TREND_DAYS", 90))
+# (delta prefix, days) of the trailing windows compared with the window before them.
+PERIODS = (("wow", 7), ("mom", 30))
+
+def age_in_days(dialect_name: str, day, as_of: date):
+    """SQL expression for the whole days from a Date expression to as_of."""
+    if dialect_name == "sqlite":
+        return cast(func.julianday(literal(as_of.isoformat())) - func.julianday(day), Integer)
+    if dialect_name == "mysql":
+        return func.datediff(literal(as_of), day)
+    return literal(as_of) - day
+
+def daily_emissions_query(dialect_name: str, as_of: date, days: int, user_ids=None, use_rollup: bool = True):
+    """(user_id, activity_type, age in days, emission) per user, type and day in the `days` up to as_of."""
+    first = as_of - timedelta(days=days - 1)
+    if use_rollup:
+        age = age_in_days(dialect_name, EmissionDaily.day, as_of)
+        query = (
+            select(EmissionDaily.user_id, EmissionDaily.activity_type, age, EmissionDaily.total_emission)
+            .where(EmissionDaily.day >= first, EmissionDaily.day <= as_of)
+        )
+        user_column = EmissionDaily.user_id
+    else:
+        day = day_of(dialect_name, Activity.activity_date)
+        age = age_in_days(dialect_name, day, as_of)
+        query = (
+            select(Activity.user_id, func.coalesce(Activity.activity_type, ""), age, func.sum(Activity.emission))
+            .where(Activity.activity_date >= datetime.combine(first, datetime.min.time()),
+                   Activity.activity_date < datetime.combine(as_of + timedelta(days=1), datetime.min.time()))
+            .group_by(Activity.user_id, Activity.activity_type, day)
+        )
+        user_column = Activity.user_id
+    if user_ids is not None:
+        query = query.where(user_column.in_(user_ids))
+    return query
+
+def _window_sums(rows, trend_days: int) -> tuple:
+    """({user_id: [last/previous sums per PERIODS]}, {(user_id, type): slope numerator})."""
+    centre = (trend_days - 1) / 2
+    sums = {}
+    slopes = defaultdict(float)
+    for user_id, activity_type, age, emission in rows:
+        emission = emission or 0.0
+        user_sums = sums.get(user_id)
+        if user_sums is None:
+            user_sums = sums[user_id] = [0.0] * (2 * len(PERIODS))
+        for i, (_, length) in enumerate(PERIODS):
+            if age < length:
+                user_sums[2 * i] += emission
+            elif age < 2 * length:
+                user_sums[2 * i + 1] += emission
+        if age < trend_days:
+            slopes[(user_id, activity_type or None)] += (centre - age) * emission
+    return sums, slopes
+
+def _window_sums_numpy(np, rows, trend_days: int) -> tuple:
+    if not rows:
+        return {}, {}
+    user_ids, types, ages, emissions = zip(*rows)
+    users, user_index = np.unique(np.asarray(user_ids, dtype=np.int64), return_inverse=True)
+    type_names, type_index = np.unique(np.asarray([t or "" for t in types], dtype=object), return_inverse=True)
+    ages = np.asarray(ages, dtype=np.int64)
+    emissions = np.nan_to_num(np.asarray(emissions, dtype=np.float64))
+
+    columns = []
+    for _, length in PERIODS:
+        columns.append(np.bincount(user_index, weights=np.where(ages < length, emissions, 0.0), minlength=len(users)))
+        previous = (ages >= length) & (ages < 2 * length)
+        columns.append(np.bincount(user_index, weights=np.where(previous, emissions, 0.0), minlength=len(users)))
+    sums = dict(zip(users.tolist(), np.column_stack(columns).tolist()))
+
+    weights = np.where(ages < trend_days, ((trend_days - 1) / 2 - ages) * emissions, 0.0)
+    pairs, pair_index = np.unique(user_index * len(type_names) + type_index, return_inverse=True)
+    numerators = np.bincount(pair_index, weights=weights)
+    slopes = {}
+    for pair, numerator in zip(pairs.tolist(), numerators.tolist()):
+        user, type_code = divmod(pair, len(type_names))
+        slopes[(int(users[user]), type_names[type_code] or None)] = numerator
+    return sums, slopes
+
+def _percent_change(current: float, previous: float):
+    return (current - previous) / previous * 100 if previous else None
+
+# Whether each engine's database has the rollup table; checked once per engine.
+_rollup_available = {}
+
+def rollup_available(connection) -> bool:
+    engine = connection.engine
+    if engine not in _rollup_available:
+        _rollup_available[engine] = inspect(connection).has_table(EmissionDaily.__tablename__)
+    return _rollup_available[engine]
+
+def compute_trends(db: Session, user_ids, as_of: date, trend_days: int = TREND_DAYS) -> dict:
+    """{user_id: trends} for user_ids (every user when None) in one query and one pass."""
+    connection = db.connection()
+    dialect_name = connection.dialect.name
+    if user_ids is None:
+        user_ids = connection.execute(select(User.id)).scalars().all()
+        query_ids = None
+    else:
+        user_ids = query_ids = list(user_ids)
+    days = max(trend_days, 2 * max(length for _, length in PERIODS))
+    use_rollup = rollup_available(connection)
+    rows = connection.execute(daily_emissions_query(dialect_name, as_of, days, query_ids, use_rollup)).all()
+
+    np = get_numpy()
+    if np is not None:
+        sums, slope_numerators = _window_sums_numpy(np, rows, trend_days)
+    else:
+        sums, slope_numerators = _window_sums(rows, trend_days)
+    # Sum of squared deviations of 0..trend_days-1 from their mean.
+    denominator = trend_days * (trend_days ** 2 - 1) / 12 or 1.0
+    type_slopes = defaultdict(dict)
+    for (user_id, activity_type), numerator in slope_numerators.items():
+        type_slopes[user_id][activity_type] = numerator / denominator
+
+    trends = {}
+    empty = [0.0] * (2 * len(PERIODS))
+    for user_id in user_ids:
+        user_sums = sums.get(user_id, empty)
+        result = {"user_id": user_id, "as_of": as_of}
+        for i, (prefix, length) in enumerate(PERIODS):
+            last, previous = user_sums[2 * i], user_sums[2 * i + 1]
+            result[f"last_{length}_days"] = last
+            result[f"previous_{length}_days"] = previous
+            result[f"{prefix}_delta"] = last - previous
+            result[f"{prefix}_percent"] = _percent_change(last, previous)
+        for prefix, length in PERIODS:
+            result[f"rolling_{length}_day_avg"] = result[f"last_{length}_days"] / length
+        result["type_slopes"] = dict(sorted(type_slopes.get(user_id, {}).items(),
+                                            key=lambda item: -item[1]))
+        trends[user_id] = result
+    return trends
+
+def user_trends(user_ids=None, as_of: date = None, trend_days: int = TREND_DAYS, session: Session = None) -> list:
+    """Trends for user_ids (every user when None), in user id order."""
+    as_of = as_of or datetime.utcnow().date()
+    if session is not None:
+        trends = compute_trends(session, user_ids, as_of, trend_days)
+    elif user_ids is None:
+        def run():
+            with session_scope() as db:
+                return compute_trends(db, None, as_of, trend_days)
+        trends = aggregate_cache.get_or_compute("trends", (None, as_of, trend_days), run)
+    else:
+        def run_missing(missing):
+            with session_scope() as db:
+                return compute_trends(db, missing, as_of, trend_days)
+        trends = aggregate_cache.get_or_compute_many("trends", (as_of, trend_days), set(user_ids), run_missing)
+    return [trends[user_id] for user_id in sorted(trends)]
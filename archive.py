@@ -0,0 +1,181 @@
+"""Columnar, memory-mappable snapshot of the activities table.
+
+A snapshot is a directory of fixed-width little-endian column files:
+
+    user_id.bin        int64
+    type_code.bin      uint16, index into dictionary.json's activity_type list
+    quantity.bin       float64 (nan when NULL)
+    emission.bin       float64 (nan when NULL)
+    activity_date.bin  int64 seconds since the Unix epoch, UTC (0 when NULL)
+    dictionary.json    {"activity_type": [...]}
+    header.json        format version, row count and column layout
+
+Rows are in activity id order. header.json is written last, so a directory
+without one is an incomplete snapshot. Readers memory-map the column files
+and get memoryview (or NumPy) views over them: scanning a column touches the
+page cache only, with no per-row parsing or objects.
+
+    write_snapshot("snapshots/2025-01")
+    with Snapshot("snapshots/2025-01") as snapshot:
+        emissions = snapshot.numpy("emission")
+        per_type = numpy.bincount(snapshot.numpy("type_code"), weights=emissions)
+"""
+import json
+import mmap
+import os
+import sys
+import time
+from array import array
+from datetime import datetime
+from math import nan
+from sqlalchemy import BigInteger, cast, extract, func, select
+from sqlalchemy.orm import Session
+from models import Activity, session_scope
+
+FORMAT_NAME = "ecotracker-columnar"
+FORMAT_VERSION = 1
+SNAPSHOT_BATCH_SIZE = 50000
+
+# name -> (array typecode, NumPy dtype)
+COLUMNS = {
+    "user_id": ("q", "<i8"),
+    "type_code": ("H", "<u2"),
+    "quantity": ("d", "<f8"),
+    "emission": ("d", "<f8"),
+    "activity_date": ("q", "<i8"),
+}
+
+def epoch_of(dialect_name: str, column):
+    """SQL expression for a DateTime column as whole seconds since the epoch."""
+    if dialect_name == "sqlite":
+        return cast(func.strftime("%s", column), BigInteger)
+    return cast(extract("epoch", column), BigInteger)
+
+def write_snapshot(directory: str, start: datetime = None, end: datetime = None,
+                   batch_size: int = SNAPSHOT_BATCH_SIZE, session: Session = None) -> dict:
+    """Write activities dated in [start, end) as a snapshot; returns its header."""
+    os.makedirs(directory, exist_ok=True)
+    header_path = os.path.join(directory, "header.json")
+    if os.path.exists(header_path):
+        os.remove(header_path)
+
+    started = time.perf_counter()
+    codes = {}
+    rows = 0
+    files = {name: open(os.path.join(directory, f"{name}.bin"), "wb") for name in COLUMNS}
+    try:
+        with session_scope(session) as db:
+            dialect_name = db.get_bind().dialect.name
+            query = select(
+                Activity.user_id,
+                Activity.activity_type,
+                Activity.quantity,
+                Activity.emission,
+                func.coalesce(epoch_of(dialect_name, Activity.activity_date), 0),
+            ).order_by(Activity.id)
+            if start is not None:
+                query = query.where(Activity.activity_date >= start)
+            if end is not None:
+                query = query.where(Activity.activity_date < end)
+            result = db.connection().execute(query.execution_options(yield_per=batch_size))
+            for batch in result.partitions(batch_size):
+                user_ids, types, quantities, emissions, dates = zip(*batch)
+                type_codes = array("H")
+                for activity_type in types:
+                    code = codes.get(activity_type)
+                    if code is None:
+                        code = codes[activity_type] = len(codes)
+                    type_codes.append(code)
+                columns = {
+                    "user_id": array("q", user_ids),
+                    "type_code": type_codes,
+                    "quantity": _float_column(quantities),
+                    "emission": _float_column(emissions),
+                    "activity_date": array("q", dates),
+                }
+                for name, values in columns.items():
+                    if sys.byteorder == "big":
+                        values.byteswap()
+                    values.tofile(files[name])
+                rows += len(batch)
+    finally:
+        for f in files.values():
+            f.close()
+
+    with open(os.path.join(directory, "dictionary.json"), "w", encoding="utf-8") as f:
+        json.dump({"activity_type": sorted(codes, key=codes.get)}, f, indent=2)
+    header = {
+        "format": FORMAT_NAME,
+        "version": FORMAT_VERSION,
+        "rows": rows,
+        "byteorder": "little",
+        "created_at": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
+        "columns": {name: {"file": f"{name}.bin", "typecode": typecode, "dtype": dtype}
+                    for name, (typecode, dtype) in COLUMNS.items()},
+    }
+    with open(header_path, "w", encoding="utf-8") as f:
+        json.dump(header, f, indent=2)
+    elapsed = time.perf_counter() - started
+    print(f"Wrote snapshot of {rows} activities to {directory} in {elapsed:.1f}s")
+    return header
+
+def _float_column(values) -> array:
+    try:
+        return array("d", values)
+    except TypeError:
+        return array("d", [nan if value is None else value for value in values])
+
+class Snapshot:
+    """Read-only, memory-mapped view of a snapshot directory."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, "header.json"), encoding="utf-8") as f:
+            self.header = json.load(f)
+        if self.header.get("format") != FORMAT_NAME or self.header.get("version") != FORMAT_VERSION:
+            raise ValueError(f"{directory} is not a version {FORMAT_VERSION} {FORMAT_NAME} snapshot")
+        with open(os.path.join(directory, "dictionary.json"), encoding="utf-8") as f:
+            self.activity_types = json.load(f)["activity_type"]
+        self.rows = self.header["rows"]
+        self._maps = {}
+
+    def _buffer(self, name: str):
+        if name not in self.header["columns"]:
+            raise KeyError(f"unknown snapshot column {name!r}")
+        if name not in self._maps:
+            path = os.path.join(self.directory, self.header["columns"][name]["file"])
+            with open(path, "rb") as f:
+                # mmap cannot map an empty file.
+                self._maps[name] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.rows else b""
+        return self._maps[name]
+
+    def column(self, name: str) -> memoryview:
+        """Zero-copy memoryview of a column, typed by its array typecode."""
+        if sys.byteorder != "little":
+            raise RuntimeError("memoryview columns need a little-endian host; use numpy() instead")
+        return memoryview(self._buffer(name)).cast(self.header["columns"][name]["typecode"])
+
+    def numpy(self, name: str):
+        """Zero-copy, read-only NumPy array over a column."""
+        import numpy
+        return numpy.frombuffer(self._buffer(name), dtype=self.header["columns"][name]["dtype"], count=self.rows)
+
+    def type_code(self, activity_type: str) -> int:
+        return self.activity_types.index(activity_type)
+
+    def close(self):
+        # Views handed out keep their mapping alive; closing with exports
+        # outstanding raises BufferError, so only close unreferenced maps.
+        for name, buffer in list(self._maps.items()):
+            if isinstance(buffer, mmap.mmap):
+                try:
+                    buffer.close()
+                except BufferError:
+                    continue
+            del self._maps[name]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,61 @@
+"""Throughput of add_activities_bulk against per-row add_activity.
+
+    python benchmarks/bench_bulk_insert.py --rows 200000
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+with tempfile.NamedTemporaryFile(suffix=".db", delete=False) as _db:
+    os.environ["DATABASE_URL"] = f"sqlite:///{_db.name}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrations import init_db
+from models import session_scope, User
+from operations import add_activities_bulk, add_activity, EMISSION_FACTORS
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--single-rows", type=int, default=2000)
+    args = parser.parse_args()
+
+    init_db()
+    with session_scope() as session:
+        session.add_all(User(username=f"user{i}", password_hash="x") for i in range(args.users))
+
+    rng = random.Random(1)
+    types = list(EMISSION_FACTORS)
+    rows = [
+        {"user_id": rng.randint(1, args.users), "activity_type": rng.choice(types), "quantity": rng.uniform(1, 300)}
+        for _ in range(args.rows)
+    ]
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for row in rows[:args.single_rows]:
+            add_activity(row["user_id"], row["activity_type"], row["quantity"])
+    single_rate = args.single_rows / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    report = add_activities_bulk(rows)
+    bulk_rate = report["inserted"] / (time.perf_counter() - started)
+
+    print(f"add_activity:        {single_rate:>10.0f} rows/s")
+    print(f"add_activities_bulk: {bulk_rate:>10.0f} rows/s ({report['inserted']} inserted, {len(report['rejected'])} rejected)")
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        path = os.environ["DATABASE_URL"][len("sqlite:///"):]
+        # WAL mode leaves -wal and -shm files next to the database.
+        for name in (path, f"{path}-wal", f"{path}-shm"):
+            if os.path.exists(name):
+                os.unlink(name)
@@ -0,0 +1,71 @@
+"""Scalar calculate_emission loop against the calculate_emissions batch API.
+
+Runs against the built-in factors (no database needed) and checks that both
+paths produce identical values.
+
+    python benchmarks/bench_emissions.py --rows 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from array import array
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import factors
+import operations
+import utils
+from factors import EMISSION_FACTORS, FactorIndex
+
+SCENARIOS = {
+    "built-in factors": [(activity_type, factor, None, None) for activity_type, factor in EMISSION_FACTORS.items()],
+    # A dated history for one type, so rows of that type need a bisect each.
+    "dated Bus factor": (
+        [(activity_type, factor, None, None) for activity_type, factor in EMISSION_FACTORS.items() if activity_type != "Bus"]
+        + [("Bus", 0.105, None, datetime(2023, 1, 1)), ("Bus", 0.089, datetime(2023, 1, 1), None)]
+    ),
+}
+
+def run(activity_types, quantities, dates):
+    started = time.perf_counter()
+    scalar = [operations.calculate_emission(t, q, d) for t, q, d in zip(activity_types, quantities, dates)]
+    timings = [("scalar loop", time.perf_counter() - started, True)]
+
+    quantity_column = array("d", quantities)
+    for label, numpy_module in (("batch (array)", None), ("batch (numpy)", utils.get_numpy())):
+        if label.endswith("(numpy)") and numpy_module is None:
+            continue
+        saved, utils.np = utils.np, numpy_module
+        try:
+            started = time.perf_counter()
+            batch = operations.calculate_emissions(activity_types, quantity_column, dates)
+            timings.append((label, time.perf_counter() - started, list(batch) == scalar))
+        finally:
+            utils.np = saved
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    rng = random.Random(3)
+    types = list(EMISSION_FACTORS) + ["Unknown"]
+    start = datetime(2021, 1, 1)
+    activity_types = [rng.choice(types) for _ in range(args.rows)]
+    quantities = [rng.uniform(0, 500) for _ in range(args.rows)]
+    dates = [start + timedelta(days=rng.randrange(0, 1500)) for _ in range(args.rows)]
+
+    for scenario, rows in SCENARIOS.items():
+        factors._index = FactorIndex(rows)
+        timings = run(activity_types, quantities, dates)
+        scalar_seconds = timings[0][1]
+        print(f"{scenario} ({args.rows} rows)")
+        for label, seconds, identical in timings:
+            print(f"  {label:<16}{seconds:>8.3f}s  {scalar_seconds / seconds:>5.1f}x  identical={identical}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Insert throughput with and without the SQLite connection pragmas.
+
+Mimics add_activity (one commit per activity) while a reader thread keeps
+running the bar-chart aggregation, and reports inserts/s plus how long the
+reader was blocked.
+
+    python benchmarks/bench_engine.py --rows 5000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text
+from database import make_engine
+
+SCHEMA = [
+    "CREATE TABLE users (id INTEGER PRIMARY KEY, username VARCHAR NOT NULL)",
+    "CREATE TABLE activities (id INTEGER PRIMARY KEY, user_id INTEGER, activity_type VARCHAR, "
+    "quantity FLOAT, emission FLOAT, activity_date DATETIME)",
+]
+
+REPORT = (
+    "SELECT users.username, SUM(activities.emission) FROM users "
+    "JOIN activities ON users.id = activities.user_id GROUP BY users.id"
+)
+
+def run(engine, rows):
+    with engine.begin() as conn:
+        for statement in SCHEMA:
+            conn.execute(text(statement))
+        conn.execute(text("INSERT INTO users (id, username) VALUES (1, 'bench')"))
+
+    stop = threading.Event()
+    reader_stats = {"queries": 0, "worst_ms": 0.0, "errors": 0}
+
+    def reader():
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                with engine.connect() as conn:
+                    conn.execute(text(REPORT)).fetchall()
+                reader_stats["queries"] += 1
+            except Exception:
+                reader_stats["errors"] += 1
+            reader_stats["worst_ms"] = max(reader_stats["worst_ms"], (time.perf_counter() - started) * 1000)
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    started = time.perf_counter()
+    for i in range(rows):
+        with engine.begin() as conn:
+            conn.execute(
+                text("INSERT INTO activities (user_id, activity_type, quantity, emission, activity_date) "
+                     "VALUES (1, 'Driving', :q, :e, CURRENT_TIMESTAMP)"),
+                {"q": float(i), "e": i * 0.17},
+            )
+    elapsed = time.perf_counter() - started
+    stop.set()
+    thread.join()
+    engine.dispose()
+    return rows / elapsed, reader_stats
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        plain = create_engine(f"sqlite:///{os.path.join(tmp, 'plain.db')}")
+        tuned = make_engine(f"sqlite:///{os.path.join(tmp, 'tuned.db')}")
+        for name, engine in (("default", plain), ("tuned", tuned)):
+            rate, stats = run(engine, args.rows)
+            print(f"{name:<8} {rate:>10.0f} inserts/s   reader: {stats['queries']} queries, "
+                  f"worst {stats['worst_ms']:.1f} ms, {stats['errors']} errors")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Before/after benchmark for the activity index migration.
+
+Builds a throwaway SQLite database with the legacy (unindexed) schema, fills it
+with synthetic activities, times the lookups used by the reports, applies the
+migrations and times the same lookups again.
+
+    python benchmarks/bench_indexes.py --rows 1000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from migrations import migrate
+
+LEGACY_SCHEMA = """
+CREATE TABLE users (id INTEGER NOT NULL, username VARCHAR NOT NULL, password_hash VARCHAR NOT NULL,
+                    created_at DATETIME, PRIMARY KEY (id), UNIQUE (username));
+CREATE TABLE activities (id INTEGER NOT NULL, user_id INTEGER, activity_type VARCHAR, quantity FLOAT,
+                         emission FLOAT, activity_date DATETIME, PRIMARY KEY (id));
+CREATE TABLE goals (id INTEGER NOT NULL, user_id INTEGER, description VARCHAR, target_emission FLOAT,
+                    deadline DATETIME, PRIMARY KEY (id));
+"""
+
+TYPES = ["Driving", "Flying Domestic", "Flying International", "Bus", "Train", "Electricity"]
+
+QUERIES = {
+    "per-user export": (
+        "SELECT id, activity_type, quantity, emission, activity_date FROM activities "
+        "WHERE user_id = :user_id ORDER BY activity_date"
+    ),
+    "per-user date range": (
+        "SELECT SUM(emission) FROM activities "
+        "WHERE user_id = :user_id AND activity_date >= :start AND activity_date < :end"
+    ),
+    "type date range": (
+        "SELECT COUNT(*), SUM(emission) FROM activities "
+        "WHERE activity_type = :activity_type AND activity_date >= :start AND activity_date < :end"
+    ),
+}
+
+def build(path, rows, users):
+    conn = sqlite3.connect(path)
+    conn.executescript(LEGACY_SCHEMA)
+    conn.executemany(
+        "INSERT INTO users (id, username, password_hash) VALUES (?, ?, 'x')",
+        [(i, f"user{i}") for i in range(1, users + 1)],
+    )
+    rng = random.Random(42)
+    start = datetime(2020, 1, 1)
+
+    def generate():
+        for _ in range(rows):
+            quantity = rng.uniform(1, 500)
+            when = start + timedelta(seconds=rng.randrange(0, 5 * 365 * 86400))
+            yield (rng.randint(1, users), rng.choice(TYPES), quantity, quantity * 0.17,
+                   when.strftime("%Y-%m-%d %H:%M:%S.000000"))
+
+    conn.executemany(
+        "INSERT INTO activities (user_id, activity_type, quantity, emission, activity_date) VALUES (?, ?, ?, ?, ?)",
+        generate(),
+    )
+    conn.commit()
+    conn.close()
+
+def time_queries(path, users, repeats):
+    conn = sqlite3.connect(path)
+    rng = random.Random(7)
+    results = {}
+    for name, sql in QUERIES.items():
+        started = time.perf_counter()
+        for _ in range(repeats):
+            conn.execute(sql, {
+                "user_id": rng.randint(1, users),
+                "activity_type": rng.choice(TYPES),
+                "start": "2022-01-01",
+                "end": "2022-02-01",
+            }).fetchall()
+        results[name] = (time.perf_counter() - started) / repeats * 1000
+    conn.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        print(f"Building legacy database with {args.rows} activities...")
+        build(path, args.rows, args.users)
+
+        before = time_queries(path, args.users, args.repeats)
+        started = time.perf_counter()
+        migrate(create_engine(f"sqlite:///{path}"))
+        migration_seconds = time.perf_counter() - started
+        after = time_queries(path, args.users, args.repeats)
+
+    print(f"Migration took {migration_seconds:.2f}s")
+    print(f"{'query':<22}{'before (ms)':>14}{'after (ms)':>14}{'speedup':>10}")
+    for name in QUERIES:
+        print(f"{name:<22}{before[name]:>14.2f}{after[name]:>14.2f}{before[name] / after[name]:>9.1f}x")
+
+if __name__ == "__main__":
+    main()
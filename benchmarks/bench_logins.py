@@ -0,0 +1,52 @@
+"""Login throughput of CredentialVerifier against its worker count.
+
+Verifies a burst of passwords against one bcrypt hash (no database needed)
+with 0 workers (inline, the old behaviour) and with pools of increasing
+size, and reports logins/s for each.
+
+    python benchmarks/bench_logins.py --logins 64 --rounds 12
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from passlib.hash import bcrypt
+from credentials import CredentialVerifier
+
+def run(workers: int, password_hash: str, logins: int) -> float:
+    verifier = CredentialVerifier(workers=workers, max_pending=logins)
+    if workers:
+        # Start the worker processes before timing.
+        verifier.verify("warm-up", password_hash)
+    started = time.perf_counter()
+    futures = [verifier.submit("correct horse" if i % 2 else "wrong", password_hash) for i in range(logins)]
+    results = [future.result() for future in futures]
+    elapsed = time.perf_counter() - started
+    verifier.shutdown()
+    assert results.count(True) == logins // 2
+    return elapsed
+
+def main():
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=32)
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost factor")
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=sorted({0, 1, 2, 4, cpus, cpus * 2}))
+    args = parser.parse_args()
+
+    password_hash = bcrypt.using(rounds=args.rounds).hash("correct horse")
+    print(f"{args.logins} logins, bcrypt cost {args.rounds}, {cpus} CPUs, backend {bcrypt.get_backend()}")
+    baseline = None
+    for workers in args.workers:
+        elapsed = run(workers, password_hash, args.logins)
+        rate = args.logins / elapsed
+        baseline = baseline or rate
+        label = "inline" if workers == 0 else f"{workers} workers"
+        print(f"{label:>12}: {rate:8.1f} logins/s  ({rate / baseline:.2f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Cold-start import cost of `ecotrack.py --help`, checked against a budget.
+
+Runs the CLI in fresh interpreters under `python -X importtime`, adds up the
+cumulative time of the top-level imports and exits with status 1 when the
+best of --runs exceeds --budget-ms, or when a module that --help must not
+load (SQLAlchemy, passlib, tabulate, NumPy) shows up.
+
+    python benchmarks/bench_startup.py --budget-ms 150
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FORBIDDEN = ("sqlalchemy", "passlib", "tabulate", "numpy")
+
+def measure(command: list) -> tuple:
+    """Return (import microseconds, wall seconds, {module: cumulative us}) for one cold run."""
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", *command],
+                            capture_output=True, text=True, cwd=ROOT)
+    wall = time.perf_counter() - started
+    if result.returncode != 0:
+        sys.exit(f"{' '.join(command)} failed:\n{result.stderr}")
+    modules = {}
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not name.startswith("  "):  # top-level import; nested ones are inside its cumulative time
+            total += int(cumulative)
+        modules[name.strip()] = int(cumulative)
+    return total, wall, modules
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=150.0, help="import-time budget in milliseconds")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="show the N slowest imports")
+    args = parser.parse_args()
+
+    command = ["ecotrack.py", "--help"]
+    runs = [measure(command) for _ in range(args.runs)]
+    total, wall, modules = min(runs, key=lambda run: run[0])
+    print(f"{' '.join(command)}: imports {total / 1000:.1f} ms (best of {args.runs}), "
+          f"process {wall * 1000:.0f} ms, budget {args.budget_ms:.0f} ms")
+    for name, cumulative in sorted(modules.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    failures = []
+    loaded = sorted({name.split(".")[0] for name in modules} & set(FORBIDDEN))
+    if loaded:
+        failures.append(f"--help imported {', '.join(loaded)}")
+    if total / 1000 > args.budget_ms:
+        failures.append(f"import time {total / 1000:.1f} ms is over the {args.budget_ms:.0f} ms budget")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from changes import subscribe
+
+# In-process cache for aggregate query results (per-user totals, breakdowns,
+# leaderboards). Keys include a data version: each user has a counter that
+# is bumped whenever a committed write touches their activities, a global
+# counter is bumped on every write, and a generation counter is bumped by
+# writes that touch every user (delete_all_activities). Entries for old versions are
+# never served again and simply age out through LRU/TTL eviction.
+#
+# Versions are per process; writes made by other processes are picked up
+# once the TTL expires.
+
+DEFAULT_MAX_ENTRIES = int(os.getenv("AGGREGATE_CACHE_MAX_ENTRIES", 1024))
+DEFAULT_TTL_SECONDS = float(os.getenv("AGGREGATE_CACHE_TTL", 300))
+
+class AggregateCache:
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl: float = DEFAULT_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._user_versions = {}
+        self._global_version = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def user_version(self, user_id: int) -> tuple:
+        with self._lock:
+            return self._generation, self._user_versions.get(user_id, 0)
+
+    def global_version(self) -> int:
+        with self._lock:
+            return self._global_version
+
+    def get_or_compute(self, name: str, params: tuple, compute, user_id: int = None):
+        """Return the cached result for (name, params), computing it on a miss.
+
+        Results scoped to one user are keyed on that user's data version,
+        everything else on the global version.
+        """
+        version = self.user_version(user_id) if user_id is not None else self.global_version()
+        key = (name, params, version)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return value
+                del self._entries[key]
+                self._stats["expirations"] += 1
+            self._stats["misses"] += 1
+
+        value = compute()
+        with self._lock:
+            self._entries[key] = (now + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+        return value
+
+    def get_or_compute_many(self, name: str, params: tuple, user_ids, compute) -> dict:
+        """Per-user results of (name, params) for user_ids, keyed on each user's data version.
+
+        compute(missing_user_ids) is called once, for all the misses together,
+        and must return {user_id: result} for each of them.
+        """
+        now = time.monotonic()
+        found, missing = {}, {}
+        with self._lock:
+            for user_id in user_ids:
+                key = (name, params, (self._generation, self._user_versions.get(user_id, 0)), user_id)
+                entry = self._entries.get(key)
+                if entry is not None:
+                    expires_at, value = entry
+                    if expires_at > now:
+                        self._entries.move_to_end(key)
+                        self._stats["hits"] += 1
+                        found[user_id] = value
+                        continue
+                    del self._entries[key]
+                    self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                missing[user_id] = key
+        if missing:
+            computed = compute(list(missing))
+            with self._lock:
+                for user_id, key in missing.items():
+                    self._entries[key] = (now + self.ttl, computed[user_id])
+                    self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self._stats["evictions"] += 1
+            found.update(computed)
+        return found
+
+    def invalidate(self, user_ids=(), all_users: bool = False):
+        """Bump data versions after a write; see changes.subscribe."""
+        with self._lock:
+            self._global_version += 1
+            if all_users:
+                self._generation += 1
+            else:
+                for user_id in user_ids:
+                    self._user_versions[user_id] = self._user_versions.get(user_id, 0) + 1
+            self._stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries))
+
+aggregate_cache = AggregateCache()
+subscribe(aggregate_cache.invalidate)
@@ -0,0 +1,69 @@
+from sqlalchemy import event, func, insert, literal, select
+from sqlalchemy.orm import Session
+from models import Activity, ActivityChange, ExportWatermark
+
+# Write paths call record_change() with the users whose activities (or
+# goals) they touched. The ids are held on the session and handed to subscribers only
+# once the transaction commits; a rollback discards them. Subscribers (the
+# aggregate cache, the goal monitor) therefore never react to writes that
+# did not happen.
+
+_subscribers = []
+
+def subscribe(callback):
+    """Call callback(user_ids: set, all_users: bool) after every commit that changed activity or goal data."""
+    _subscribers.append(callback)
+
+def unsubscribe(callback):
+    if callback in _subscribers:
+        _subscribers.remove(callback)
+
+def record_change(session: Session, user_ids=None):
+    """Note that activity data changed for user_ids (None: for every user)."""
+    if user_ids is None:
+        session.info["all_users_changed"] = True
+    else:
+        session.info.setdefault("changed_users", set()).update(user_ids)
+
+@event.listens_for(Session, "after_commit")
+def _notify_subscribers(session: Session):
+    user_ids = session.info.pop("changed_users", set())
+    all_users = session.info.pop("all_users_changed", False)
+    if not user_ids and not all_users:
+        return
+    for callback in list(_subscribers):
+        callback(user_ids, all_users)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changes(session: Session):
+    session.info.pop("changed_users", None)
+    session.info.pop("all_users_changed", None)
+
+# Updates and deletes are also appended to the activity_changes table, in the
+# writer's transaction, so incremental exports (export.export_changes) can
+# pick them up. New activities need no entry: their ids are above the
+# consumer's watermark. Nothing is logged until some consumer has a
+# watermark (its first export registers one before reading), so the log
+# only grows while there is someone to read and prune it.
+
+def _has_consumers(session: Session) -> bool:
+    return session.scalar(select(ExportWatermark.consumer).limit(1)) is not None
+
+def log_activity_changes(session: Session, op: str, *filters):
+    """Log `op` ("update" or "delete") for every activity matching filters."""
+    if not _has_consumers(session):
+        return
+    session.execute(
+        insert(ActivityChange).from_select(
+            ["activity_id", "op", "changed_at"],
+            select(Activity.id, literal(op), func.current_timestamp()).where(*filters),
+        )
+    )
+
+def log_truncate(session: Session):
+    """Log that every activity is about to be deleted, as a single entry."""
+    if not _has_consumers(session):
+        return
+    last_id = session.scalar(select(func.max(Activity.id)))
+    if last_id is not None:
+        session.execute(insert(ActivityChange).values(activity_id=last_id, op="truncate"))
@@ -0,0 +1,152 @@
+"""Password verification on a bounded process pool.
+
+bcrypt is deliberately slow, and passlib's pure-Python fallback backends hold
+the GIL while hashing, so verifying inline serialises every concurrent login
+behind one core and stalls whatever else the process is doing. The verifier
+hands each check to a worker process instead and caps how many checks may be
+queued; once the cap is reached new logins are refused with QueueFullError
+rather than piling up.
+
+    verifier = get_verifier()
+    ok = verifier.verify(password, user.password_hash)          # blocking
+    ok = await verifier.verify_async(password, user.password_hash)
+
+AUTH_WORKERS sets the pool size (default: one per CPU; 0 verifies inline in
+the calling thread) and AUTH_MAX_PENDING the queue-depth limit. A worker that
+dies breaks the whole pool; the verifier then starts a fresh pool and retries
+the affected checks once.
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+DEFAULT_WORKERS = int(os.getenv("AUTH_WORKERS", os.cpu_count() or 1))
+DEFAULT_MAX_PENDING = int(os.getenv("AUTH_MAX_PENDING", 64))
+
+class QueueFullError(RuntimeError):
+    pass
+
+def _check_password(password: str, password_hash: str) -> bool:
+    # Runs in the worker process; must stay a top-level function so it pickles.
+    from passlib.hash import bcrypt
+    try:
+        return bcrypt.verify(password, password_hash)
+    except ValueError:
+        # Malformed or non-bcrypt hash.
+        return False
+
+class CredentialVerifier:
+    def __init__(self, workers: int = DEFAULT_WORKERS, max_pending: int = DEFAULT_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._stats = {"submitted": 0, "completed": 0, "rejected": 0, "pool_restarts": 0}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _discard_executor(self, executor: ProcessPoolExecutor):
+        """Drop a broken pool so the next check starts a new one."""
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+            self._stats["pool_restarts"] += 1
+        executor.shutdown(wait=False)
+
+    def _submit_to_pool(self, result: Future, password: str, password_hash: str, retries: int = 1):
+        """Run the check on the pool and pass its outcome to result, retrying on a fresh pool if it broke."""
+        executor = self._get_executor()
+        try:
+            future = executor.submit(_check_password, password, password_hash)
+        except BrokenProcessPool as e:
+            future = Future()
+            future.set_exception(e)
+
+        def done(future: Future):
+            if future.cancelled():
+                result.cancel()
+                return
+            error = future.exception()
+            if isinstance(error, BrokenProcessPool) and retries > 0:
+                self._discard_executor(executor)
+                try:
+                    self._submit_to_pool(result, password, password_hash, retries - 1)
+                except Exception as e:
+                    result.set_exception(e)
+            elif error is not None:
+                result.set_exception(error)
+            else:
+                result.set_result(future.result())
+        future.add_done_callback(done)
+
+    def _release(self, _future=None):
+        self._slots.release()
+        with self._lock:
+            self._stats["completed"] += 1
+
+    def submit(self, password: str, password_hash: str) -> Future:
+        """Queue a check and return a Future resolving to True/False.
+
+        Raises QueueFullError when max_pending checks are already in flight.
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise QueueFullError(f"{self.max_pending} credential checks already pending")
+        with self._lock:
+            self._stats["submitted"] += 1
+        future = Future()
+        try:
+            if self.workers > 0:
+                self._submit_to_pool(future, password, password_hash)
+            else:
+                future.set_result(_check_password(password, password_hash))
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def verify(self, password: str, password_hash: str, timeout: float = None) -> bool:
+        return self.submit(password, password_hash).result(timeout)
+
+    async def verify_async(self, password: str, password_hash: str) -> bool:
+        return await asyncio.wrap_future(self.submit(password, password_hash))
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["pending"] = stats["submitted"] - stats["completed"]
+        return stats
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+_verifier = None
+_verifier_lock = threading.Lock()
+
+def get_verifier() -> CredentialVerifier:
+    """The process-wide verifier, created on first use."""
+    global _verifier
+    with _verifier_lock:
+        if _verifier is None:
+            _verifier = CredentialVerifier()
+        return _verifier
+
+def shutdown_verifier():
+    global _verifier
+    with _verifier_lock:
+        verifier, _verifier = _verifier, None
+    if verifier is not None:
+        verifier.shutdown()
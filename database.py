@@ -0,0 +1,65 @@
+import os
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+
+load_dotenv()
+
+# Default database lives next to the code rather than in whatever directory
+# the CLI happens to be started from.
+DEFAULT_DATABASE_URL = "sqlite:///" + os.path.join(os.path.dirname(os.path.abspath(__file__)), "ecotracker.db")
+
+# Applied to every new SQLite connection. WAL lets readers (reports, exports)
+# run alongside a writer, and synchronous=NORMAL is safe under WAL while
+# avoiding an fsync per commit.
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", -64000)),  # negative = KiB, so ~64 MB
+    "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT", 5000)),  # ms
+}
+
+def get_database_url() -> str:
+    return os.getenv("DATABASE_URL", DEFAULT_DATABASE_URL)
+
+def _env_flag(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+def _apply_sqlite_pragmas(engine: Engine, pragmas: dict):
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+def make_engine(url: str = None, **kwargs) -> Engine:
+    """Create an engine for the given (or configured) database URL.
+
+    SQLite connections get SQLITE_PRAGMAS applied on connect. Server databases
+    get a tunable connection pool (DB_POOL_SIZE, DB_MAX_OVERFLOW,
+    DB_POOL_PRE_PING, DB_POOL_RECYCLE). Keyword arguments override both.
+    """
+    url = url or get_database_url()
+    if url.startswith("sqlite"):
+        pragmas = dict(SQLITE_PRAGMAS)
+        pragmas.update(kwargs.pop("pragmas", None) or {})
+        engine = create_engine(url, **kwargs)
+        _apply_sqlite_pragmas(engine, pragmas)
+        return engine
+
+    options = {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 10)),
+        "pool_pre_ping": _env_flag("DB_POOL_PRE_PING", True),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", 1800)),
+    }
+    options.update(kwargs)
+    return create_engine(url, **options)
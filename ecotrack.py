@@ -0,0 +1,300 @@
+"""EcoTracker command line.
+
+One command per process, suitable for scripts and cron jobs:
+
+    python ecotrack.py add_activity --user_id 1 --type Driving --quantity 50
+    python ecotrack.py add_activity --file activities.csv
+    cat activities.jsonl | python ecotrack.py add_activity --file -
+    python ecotrack.py list_activities --user_id 1 --format csv --limit 1000
+
+Listing commands accept --format table|json|csv; json and csv are written
+row by row, so large listings stream.
+
+Only click is imported up front. Each command imports the database layer
+(and tabulate, passlib, ...) when it runs, so --help and usage errors start
+without loading SQLAlchemy.
+"""
+import csv
+import json
+import sys
+from datetime import datetime, timedelta
+from itertools import islice
+import click
+from utils import json_default
+
+FORMATS = click.Choice(["table", "json", "csv"])
+DATE = click.DateTime(formats=["%Y-%m-%d", "%Y-%m-%d %H:%M:%S"])
+TABLE_PAGE_SIZE = 1000
+BAR_WIDTH = 50
+
+def _emit(fields, rows, fmt: str, out=None):
+    """Write rows (tuples matching fields) to out (default stdout) in the requested format."""
+    out = out or sys.stdout
+    if fmt == "csv":
+        writer = csv.writer(out)
+        writer.writerow(fields)
+        writer.writerows(rows)
+    elif fmt == "json":
+        out.write("[")
+        for i, row in enumerate(rows):
+            out.write(",\n" if i else "\n")
+            out.write(json.dumps(dict(zip(fields, row)), default=json_default))
+        out.write("\n]\n")
+    else:
+        from tabulate import tabulate
+        headers = [field.replace("_", " ").title() for field in fields]
+        rows = iter(rows)
+        shown = False
+        while True:
+            page = list(islice(rows, TABLE_PAGE_SIZE))
+            if not page:
+                break
+            out.write(tabulate(page, headers=headers, tablefmt="grid") + "\n")
+            shown = True
+        if not shown:
+            out.write("No rows found.\n")
+
+def _bar_rows(rows, label_index: int, value_index: int):
+    """Append a text bar scaled to the largest value to each row."""
+    rows = list(rows)
+    largest = max((row[value_index] for row in rows), default=0)
+    for row in rows:
+        length = int(row[value_index] / largest * BAR_WIDTH) if largest > 0 else 0
+        yield row[label_index], f"{row[value_index]:.2f}", "█" * length
+
+def _operations():
+    """Import the data layer and check the schema before a command touches it."""
+    from models import engine
+    from migrations import schema_is_current
+    if not schema_is_current(engine):
+        raise click.ClickException("Database schema is missing or out of date; run `ecotrack.py init_db`.")
+    import operations
+    return operations
+
+def _activity_type(name: str) -> str:
+    """Match a type name case-insensitively against the known types."""
+    from factors import get_factor_index
+    return get_factor_index().match_type(name)
+
+@click.group()
+def cli():
+    """EcoTracker: track activities and their carbon emissions."""
+
+@cli.command("init_db")
+def init_db_command():
+    """Create the database or apply pending migrations."""
+    from migrations import init_db as migrate_db
+    version = migrate_db(verbose=True)
+    click.echo(f"Database is at schema version {version}.")
+
+@cli.command("add_user")
+@click.option("--name", "--username", "username", required=True)
+@click.option("--password", prompt=True, hide_input=True, envvar="ECOTRACK_PASSWORD",
+              help="Prompted for when omitted; may also come from ECOTRACK_PASSWORD.")
+def add_user_command(username, password):
+    """Create a user."""
+    operations = _operations()
+    if not operations.add_user(username, password):
+        sys.exit(1)
+
+@cli.command("add_activity")
+@click.option("--user_id", type=int, help="User the activity belongs to.")
+@click.option("--type", "activity_type", help="Activity type, e.g. Driving.")
+@click.option("--quantity", type=float)
+@click.option("--unit", help="Unit of --quantity if not the type's canonical unit.")
+@click.option("--emission", type=float, help="Emission in kg CO2; calculated when omitted.")
+@click.option("--file", "path", type=click.Path(allow_dash=True),
+              help="CSV or JSONL file of activities to import instead; '-' reads stdin.")
+@click.option("--input-format", type=click.Choice(["csv", "jsonl"]), default="jsonl",
+              show_default=True, help="Format of records read from stdin.")
+@click.option("--batch-size", type=int, help="Rows per transaction when importing (default 10000).")
+def add_activity_command(user_id, activity_type, quantity, unit, emission, path, input_format, batch_size):
+    """Log one activity, or import many with --file."""
+    operations = _operations()
+    if path:
+        from importer import DEFAULT_BATCH_SIZE, import_activities, import_stream
+        batch_size = batch_size or DEFAULT_BATCH_SIZE
+        if path == "-":
+            totals = import_stream(sys.stdin, is_csv=input_format == "csv", batch_size=batch_size)
+        else:
+            totals = import_activities(path, batch_size=batch_size)
+        if totals["rejected"]:
+            sys.exit(1)
+        return
+    if user_id is None or activity_type is None or quantity is None:
+        raise click.UsageError("--user_id, --type and --quantity are required unless --file is given.")
+    if operations.add_activity(user_id, _activity_type(activity_type), quantity, emission, unit=unit) is None:
+        sys.exit(1)
+
+@cli.command("list_activities")
+@click.option("--user_id", type=int)
+@click.option("--type", "activity_type")
+@click.option("--start", type=DATE, help="First date to include.")
+@click.option("--end", type=DATE, help="First date to exclude.")
+@click.option("--limit", type=int)
+@click.option("--format", "fmt", type=FORMATS, default="table", show_default=True)
+def list_activities_command(user_id, activity_type, start, end, limit, fmt):
+    """List activities, oldest first."""
+    operations = _operations()
+    if activity_type:
+        activity_type = _activity_type(activity_type)
+    rows = operations.iter_activities(user_id, activity_type, start, end)
+    _emit(["id", "activity_type", "username", "emission", "activity_date"], islice(rows, limit), fmt)
+
+@cli.command("list_users")
+@click.option("--limit", type=int)
+@click.option("--format", "fmt", type=FORMATS, default="table", show_default=True)
+def list_users_command(limit, fmt):
+    """List users."""
+    operations = _operations()
+    users = operations.get_all_users()
+    _emit(["id", "username", "created_at"], ((u.id, u.username, u.created_at) for u in users[:limit]), fmt)
+
+@cli.command("show_chart")
+@click.option("--user_id", type=int, help="Break one user's emissions down by type instead.")
+@click.option("--start", type=DATE)
+@click.option("--end", type=DATE)
+@click.option("--limit", type=int)
+@click.option("--format", "fmt", type=FORMATS, default="table", show_default=True)
+def show_chart_command(user_id, start, end, limit, fmt):
+    """Emissions by user, or by activity type for --user_id."""
+    operations = _operations()
+    if user_id is None:
+        fields = ["user_id", "username", "total_emission"]
+        rows = operations.get_leaderboard(limit, start, end)
+        label_index, value_index = 1, 2
+    else:
+        fields = ["activity_type", "total_emission", "count"]
+        rows = operations.get_type_breakdown(user_id, start, end)[:limit]
+        label_index, value_index = 0, 1
+    if fmt == "table":
+        _emit([fields[label_index], "total_emission_kg_co2", "bar"], _bar_rows(rows, label_index, value_index), fmt)
+    else:
+        _emit(fields, rows, fmt)
+
+@cli.command("set_goal")
+@click.option("--user_id", type=int, required=True)
+@click.option("--description", "--type", "description", required=True)
+@click.option("--target", type=float, required=True, help="Emission budget in kg CO2.")
+@click.option("--deadline", type=DATE, help="Defaults to one year from today.")
+@click.option("--start", type=DATE, help="First day emissions count towards the goal (default: today).")
+def set_goal_command(user_id, description, target, deadline, start):
+    """Set an emission goal for a user."""
+    operations = _operations()
+    deadline = deadline or datetime.utcnow() + timedelta(days=365)
+    if operations.add_goal(user_id, description, target, deadline, start) is None:
+        sys.exit(1)
+
+@cli.command("list_goals")
+@click.option("--user_id", type=int)
+@click.option("--all", "include_expired", is_flag=True, help="Include goals past their deadline.")
+@click.option("--limit", type=int)
+@click.option("--format", "fmt", type=FORMATS, default="table", show_default=True)
+def list_goals_command(user_id, include_expired, limit, fmt):
+    """Show goals with accrued emission, budget used and projected overshoot."""
+    operations = _operations()
+    from goals import evaluate_goals
+    progress = evaluate_goals([user_id] if user_id is not None else None, include_expired=include_expired)[:limit]
+    if fmt == "table":
+        _emit(operations.GOAL_COLUMNS, operations.goal_progress_rows(progress), fmt)
+    else:
+        fields = list(progress[0]) if progress else ["goal_id"]
+        _emit(fields, (tuple(p.values()) for p in progress), fmt)
+
+@cli.command("trends")
+@click.option("--user_id", "user_ids", type=int, multiple=True, help="Repeat for several users (default: everyone).")
+@click.option("--as-of", type=DATE, help="Last day of the trailing windows (default: today).")
+@click.option("--by-type", is_flag=True, help="List per-activity-type trend slopes instead.")
+@click.option("--limit", type=int)
+@click.option("--format", "fmt", type=FORMATS, default="table", show_default=True)
+def trends_command(user_ids, as_of, by_type, limit, fmt):
+    """Week/month-over-month changes, rolling averages and trend slopes per user."""
+    _operations()
+    from analytics import user_trends
+    trends = user_trends(user_ids or None, as_of.date() if as_of else None)
+    if by_type:
+        rows = ((t["user_id"], activity_type, slope)
+                for t in trends for activity_type, slope in t["type_slopes"].items())
+        _emit(["user_id", "activity_type", "slope_kg_per_day_per_day"], islice(rows, limit), fmt)
+        return
+    trends = trends[:limit]
+    if fmt == "json":
+        fields = list(trends[0]) if trends else ["user_id"]
+        _emit(fields, (tuple(t.values()) for t in trends), fmt)
+    else:
+        fields = ["user_id", "last_7_days", "wow_delta", "wow_percent", "last_30_days", "mom_delta",
+                  "mom_percent", "rolling_7_day_avg", "rolling_30_day_avg"]
+        rows = ([t[field] for field in fields] for t in trends)
+        if fmt == "table":
+            rows = ([row[0]] + ["" if value is None else f"{value:.2f}" for value in row[1:]] for row in rows)
+        _emit(fields, rows, fmt)
+
+@cli.command("export_data")
+@click.option("--user_id", type=int)
+@click.option("--type", "activity_type")
+@click.option("--start", type=DATE)
+@click.option("--end", type=DATE)
+@click.option("--columns", help="Comma-separated columns to export "
+              "(id, user_id, username, activity_type, quantity, emission, source_quantity, source_unit, activity_date).")
+@click.option("--limit", type=int)
+@click.option("--format", "fmt", type=click.Choice(["ndjson", "json", "csv"]), default="ndjson", show_default=True)
+@click.option("--gzip", "compress", is_flag=True, default=None, help="Compress the output (implied by a .gz name).")
+@click.option("--output", "-o", type=click.Path(allow_dash=True), default="-", show_default=True)
+def export_data_command(user_id, activity_type, start, end, columns, limit, fmt, compress, output):
+    """Stream activities to a file or stdout."""
+    _operations()
+    from export import DEFAULT_COLUMNS, export_activities
+    if activity_type:
+        activity_type = _activity_type(activity_type)
+    columns = [name.strip() for name in columns.split(",")] if columns else DEFAULT_COLUMNS
+    try:
+        count = export_activities(output, fmt, columns, user_id, activity_type, start, end, limit, compress)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    if output != "-":
+        click.echo(f"Exported {count} activities to {output}")
+
+@cli.command("export_all")
+@click.option("--output-dir", "-o", type=click.Path(file_okay=False), required=True)
+@click.option("--workers", type=int, help="Worker processes (default: one per CPU).")
+@click.option("--columns", help="Comma-separated columns to export (see export_data).")
+def export_all_command(output_dir, workers, columns):
+    """Export every user's activities as user=<id>/month=<yyyy-mm>/part.ndjson.gz plus a manifest."""
+    _operations()
+    from export import DEFAULT_COLUMNS, export_all
+    columns = [name.strip() for name in columns.split(",")] if columns else DEFAULT_COLUMNS
+    try:
+        export_all(output_dir, workers, columns)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+
+@cli.command("export_changes")
+@click.option("--consumer", required=True, help="Name the consumer's watermark is kept under.")
+@click.option("--output", "-o", type=click.Path(allow_dash=True), default="-", show_default=True)
+@click.option("--columns", help="Comma-separated columns to export (see export_data).")
+@click.option("--gzip", "compress", is_flag=True, default=None, help="Compress the output (implied by a .gz name).")
+@click.option("--reset", is_flag=True, help="Forget the consumer's watermark and export everything.")
+def export_changes_command(consumer, output, columns, compress, reset):
+    """Export new, updated and deleted activities since the consumer's last run as NDJSON."""
+    _operations()
+    from export import DEFAULT_COLUMNS, export_changes, reset_consumer
+    columns = [name.strip() for name in columns.split(",")] if columns else DEFAULT_COLUMNS
+    if reset:
+        reset_consumer(consumer)
+    try:
+        export_changes(consumer, output, columns, compress)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+
+@cli.command("snapshot")
+@click.option("--output-dir", "-o", type=click.Path(file_okay=False), required=True)
+@click.option("--start", type=DATE)
+@click.option("--end", type=DATE)
+def snapshot_command(output_dir, start, end):
+    """Write a memory-mappable columnar snapshot of activities (see archive.py)."""
+    _operations()
+    from archive import write_snapshot
+    write_snapshot(output_dir, start, end)
+
+if __name__ == "__main__":
+    cli()
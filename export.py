@@ -0,0 +1,383 @@
+"""Streaming activity export.
+
+Rows are read with a single query fetched batch_size rows at a time and
+written as they arrive, so an export of any size runs in constant memory.
+Only the requested columns are selected, and the user, type and date filters
+are part of the query.
+
+Formats: "ndjson" (one JSON object per line), "json" (a single JSON array,
+still written incrementally) and "csv". Paths ending in .gz, or compress=True,
+are gzip-compressed; "-" writes to stdout.
+
+    export_activities("2024.ndjson.gz", start=datetime(2024, 1, 1), end=datetime(2025, 1, 1))
+
+export_all() writes every user's activities as partitioned NDJSON, split by
+user id range across worker processes:
+
+    <directory>/user=<id>/month=<yyyy-mm>/part.ndjson.gz
+    <directory>/manifest.json    (row count, size and sha256 of every part)
+
+export_changes() is the incremental form for downstream consumers: it
+writes only what changed since the consumer's previous run (see its
+docstring) and then advances the consumer's watermark. It needs SQLite: new
+activities are found by id above the watermark, which is only safe when
+writers commit in id order, as SQLite's single writer does.
+"""
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import groupby, islice
+from operator import itemgetter
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import Session
+from database import make_engine
+from models import Activity, ActivityChange, ExportWatermark, User, engine, session_scope
+
+EXPORT_BATCH_SIZE = 5000
+EXPORT_FORMATS = ("ndjson", "json", "csv")
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+EXPORT_COLUMNS = {
+    "id": Activity.id,
+    "user_id": Activity.user_id,
+    "username": User.username,
+    "activity_type": Activity.activity_type,
+    "quantity": Activity.quantity,
+    "emission": Activity.emission,
+    "source_quantity": Activity.source_quantity,
+    "source_unit": Activity.source_unit,
+    "activity_date": Activity.activity_date,
+}
+DEFAULT_COLUMNS = ("id", "user_id", "activity_type", "quantity", "emission", "activity_date")
+
+def export_query(columns=DEFAULT_COLUMNS, user_id: int = None, activity_type: str = None,
+                 start: datetime = None, end: datetime = None, limit: int = None):
+    """SELECT of the given export columns in id order; users are joined only for username."""
+    unknown = [name for name in columns if name not in EXPORT_COLUMNS]
+    if unknown:
+        raise ValueError(f"unknown export column(s): {', '.join(unknown)}")
+    query = select(*(EXPORT_COLUMNS[name] for name in columns)).select_from(Activity)
+    if "username" in columns:
+        query = query.outerjoin(User, User.id == Activity.user_id)
+    if user_id is not None:
+        query = query.where(Activity.user_id == user_id)
+    if activity_type:
+        query = query.where(Activity.activity_type == activity_type)
+    if start is not None:
+        query = query.where(Activity.activity_date >= start)
+    if end is not None:
+        query = query.where(Activity.activity_date < end)
+    query = query.order_by(Activity.id)
+    return query.limit(limit) if limit is not None else query
+
+def _format_value(value):
+    if isinstance(value, datetime):
+        return value.strftime(DATE_FORMAT)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def write_rows(f, names, rows, fmt: str = "ndjson", batch_size: int = EXPORT_BATCH_SIZE) -> int:
+    """Write rows (tuples matching names) to the text stream f; returns the row count."""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"unknown export format {fmt!r}; expected one of {', '.join(EXPORT_FORMATS)}")
+    rows = iter(rows)
+    count = 0
+    if fmt == "csv":
+        writer = csv.writer(f)
+        writer.writerow(names)
+        dates = [i for i, name in enumerate(names) if name == "activity_date"]
+        for row in rows:
+            if dates:
+                row = list(row)
+                for i in dates:
+                    if row[i] is not None:
+                        row[i] = row[i].strftime(DATE_FORMAT)
+            writer.writerow(row)
+            count += 1
+        return count
+
+    encode = json.JSONEncoder(separators=(",", ":"), default=_format_value).encode
+    separator = "\n" if fmt == "ndjson" else ",\n"
+    if fmt == "json":
+        f.write("[\n")
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        lines = [encode(dict(zip(names, row))) for row in batch]
+        if count and fmt == "json":
+            f.write(separator)
+        f.write(separator.join(lines))
+        if fmt == "ndjson":
+            f.write("\n")
+        count += len(batch)
+    if fmt == "json":
+        f.write("\n]\n" if count else "]\n")
+    return count
+
+@contextmanager
+def open_output(path: str, compress: bool = None):
+    """Text stream for path ("-" for stdout), gzip-compressed if compress or path ends in .gz."""
+    if compress is None:
+        compress = path.endswith(".gz")
+    if path == "-":
+        if compress:
+            with gzip.GzipFile(fileobj=sys.stdout.buffer, mode="wb") as raw:
+                with io.TextIOWrapper(raw, encoding="utf-8", newline="") as f:
+                    yield f
+        else:
+            yield sys.stdout
+    elif compress:
+        with gzip.open(path, "wt", encoding="utf-8", newline="") as f:
+            yield f
+    else:
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            yield f
+
+def export_activities(path: str, fmt: str = "ndjson", columns=DEFAULT_COLUMNS, user_id: int = None,
+                      activity_type: str = None, start: datetime = None, end: datetime = None,
+                      limit: int = None, compress: bool = None, batch_size: int = EXPORT_BATCH_SIZE,
+                      session: Session = None) -> int:
+    """Export matching activities to path and return the number of rows written."""
+    columns = tuple(columns)
+    query = export_query(columns, user_id, activity_type, start, end, limit)
+    with session_scope(session) as db, open_output(path, compress) as f:
+        rows = db.connection().execute(query.execution_options(yield_per=batch_size))
+        return write_rows(f, columns, rows, fmt, batch_size)
+
+class _HashingWriter:
+    """Binary file wrapper counting and hashing everything written through it."""
+
+    def __init__(self, f):
+        self._f = f
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data) -> int:
+        self.sha256.update(data)
+        self.size += len(data)
+        return self._f.write(data)
+
+    def flush(self):
+        self._f.flush()
+
+def user_id_ranges(parts: int, session: Session = None) -> list:
+    """Split users with activities into at most `parts` contiguous (first_id, last_id)
+    ranges holding roughly equal numbers of activities."""
+    with session_scope(session) as db:
+        counts = db.execute(
+            select(Activity.user_id, func.count()).group_by(Activity.user_id).order_by(Activity.user_id)
+        ).all()
+    total = sum(count for _, count in counts)
+    if not total:
+        return []
+    target = total / parts
+    ranges = []
+    first = None
+    filled = 0
+    for user_id, count in counts:
+        if first is None:
+            first = user_id
+        filled += count
+        if filled >= target * (len(ranges) + 1):
+            ranges.append((first, user_id))
+            first = None
+    if first is not None:
+        ranges.append((first, counts[-1][0]))
+    return ranges
+
+def _init_worker():
+    # Connections inherited from the parent must not be used by the child.
+    engine.dispose(close=False)
+
+def export_user_range(database_url: str, directory: str, first_id: int, last_id: int,
+                      columns=DEFAULT_COLUMNS, batch_size: int = EXPORT_BATCH_SIZE) -> list:
+    """Write the partitions of users first_id..last_id; runs in a worker process.
+
+    Uses its own engine and connection. Returns one manifest entry per part.
+    """
+    columns = tuple(columns)
+    worker_engine = make_engine(database_url)
+    query = (
+        select(Activity.user_id, Activity.activity_date,
+               *(EXPORT_COLUMNS[name] for name in columns)).select_from(Activity)
+    )
+    if "username" in columns:
+        query = query.outerjoin(User, User.id == Activity.user_id)
+    query = (
+        query.where(Activity.user_id.between(first_id, last_id))
+        .order_by(Activity.user_id, Activity.activity_date, Activity.id)
+        .execution_options(yield_per=batch_size)
+    )
+
+    def partition(row):
+        return row[0], row[1].strftime("%Y-%m") if row[1] is not None else "unknown"
+
+    parts = []
+    try:
+        with worker_engine.connect() as conn:
+            for (user_id, month), rows in groupby(conn.execute(query), key=partition):
+                relative = os.path.join(f"user={user_id}", f"month={month}", "part.ndjson.gz")
+                path = os.path.join(directory, relative)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "wb") as raw:
+                    hashing = _HashingWriter(raw)
+                    with gzip.GzipFile(filename="", fileobj=hashing, mode="wb", mtime=0) as compressed:
+                        with io.TextIOWrapper(compressed, encoding="utf-8", newline="") as f:
+                            count = write_rows(f, columns, (row[2:] for row in rows), "ndjson", batch_size)
+                parts.append({
+                    "path": relative.replace(os.sep, "/"),
+                    "user_id": user_id,
+                    "month": month,
+                    "rows": count,
+                    "bytes": hashing.size,
+                    "sha256": hashing.sha256.hexdigest(),
+                })
+    finally:
+        worker_engine.dispose()
+    return parts
+
+def export_all(directory: str, workers: int = None, columns=DEFAULT_COLUMNS,
+               batch_size: int = EXPORT_BATCH_SIZE) -> dict:
+    """Export every activity into partitioned NDJSON under directory and
+    return the manifest, which is written last as manifest.json."""
+    columns = tuple(columns)
+    export_query(columns)  # validates the column names before any work starts
+    workers = workers or os.cpu_count() or 1
+    database_url = engine.url.render_as_string(hide_password=False)
+    # More ranges than workers, so a worker that finishes early picks up more.
+    ranges = user_id_ranges(workers * 4)
+    os.makedirs(directory, exist_ok=True)
+
+    started = time.perf_counter()
+    parts = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = [
+            pool.submit(export_user_range, database_url, directory, first_id, last_id, columns, batch_size)
+            for first_id, last_id in ranges
+        ]
+        for future in futures:
+            parts.extend(future.result())
+    parts.sort(key=itemgetter("user_id", "month"))
+
+    manifest = {
+        "created_at": datetime.utcnow().strftime(DATE_FORMAT),
+        "format": "ndjson.gz",
+        "columns": list(columns),
+        "rows": sum(part["rows"] for part in parts),
+        "parts": parts,
+    }
+    with open(os.path.join(directory, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    elapsed = time.perf_counter() - started
+    print(f"Exported {manifest['rows']} activities in {len(parts)} parts to {directory} "
+          f"with {workers} workers in {elapsed:.1f}s")
+    return manifest
+
+def export_changes(consumer: str, path: str, columns=DEFAULT_COLUMNS, compress: bool = None,
+                   batch_size: int = EXPORT_BATCH_SIZE) -> dict:
+    """Write the activity changes consumer has not seen yet to path as NDJSON.
+
+    Every line has an "op":
+
+        {"op": "truncate", "through_id": N}   every activity with id <= N was deleted
+        {"op": "delete", "id": ...}           a previously exported activity was deleted
+        {"op": "update", ...columns}          a previously exported activity changed
+        {"op": "insert", ...columns}          a new activity
+
+    A consumer's first run exports everything as inserts. The watermark
+    (last activity id and change sequence) only moves once the file has been
+    written completely, so a failed run is simply repeated: delivery is at
+    least once and consumers should apply rows by id. Returns the number of
+    lines written per op.
+
+    Only SQLite is supported. On databases with concurrent writers (e.g.
+    PostgreSQL) an id can commit after a higher one has been exported, and
+    that activity would never be picked up.
+    """
+    if engine.dialect.name != "sqlite":
+        raise ValueError(f"incremental export needs SQLite, not {engine.dialect.name}: "
+                         "activity ids may commit out of order")
+    columns = tuple(columns)
+    if "id" not in columns:
+        columns = ("id",) + columns
+    names = ("op",) + columns
+    counts = {"truncate": 0, "delete": 0, "update": 0, "insert": 0}
+
+    # Register a new consumer before reading anything: changes are only
+    # logged while some consumer exists (see changes.py).
+    with session_scope() as db:
+        if db.get(ExportWatermark, consumer) is None:
+            db.add(ExportWatermark(consumer=consumer, last_activity_id=0, last_change_seq=0, runs=0))
+
+    with session_scope() as db:
+        watermark = db.get(ExportWatermark, consumer)
+        last_id = watermark.last_activity_id
+        last_seq = watermark.last_change_seq
+        # Upper bounds for this run; anything committed later is left for the next one.
+        max_id = db.scalar(select(func.max(Activity.id))) or 0
+        max_seq = db.scalar(select(func.max(ActivityChange.seq))) or 0
+        window = [ActivityChange.seq > last_seq, ActivityChange.seq <= max_seq]
+        # Only activities the consumer already has need updates or tombstones;
+        # a truncate covers everything up to its id.
+        truncated_through = db.scalar(
+            select(func.max(ActivityChange.activity_id)).where(*window, ActivityChange.op == "truncate")
+        ) if last_id else None
+        seen = [ActivityChange.activity_id <= last_id, ActivityChange.activity_id > (truncated_through or 0)]
+
+        def changed_ids(op):
+            return select(ActivityChange.activity_id).where(*window, *seen, ActivityChange.op == op).distinct()
+
+        def stream(query, op):
+            rows = db.connection().execute(query.execution_options(yield_per=batch_size))
+            return ((op,) + tuple(row) for row in rows)
+
+        with open_output(path, compress) as f:
+            if truncated_through:
+                f.write(json.dumps({"op": "truncate", "through_id": truncated_through}, separators=(",", ":")) + "\n")
+                counts["truncate"] = 1
+            counts["delete"] = write_rows(f, ("op", "id"), stream(
+                select(ActivityChange.activity_id).where(*window, *seen, ActivityChange.op == "delete")
+                .distinct().order_by(ActivityChange.activity_id), "delete"), "ndjson", batch_size)
+            counts["update"] = write_rows(f, names, stream(
+                export_query(columns).where(Activity.id.in_(changed_ids("update"))), "update"), "ndjson", batch_size)
+            counts["insert"] = write_rows(f, names, stream(
+                export_query(columns).where(Activity.id > last_id, Activity.id <= max_id), "insert"), "ndjson", batch_size)
+
+    with session_scope() as db:
+        watermark = db.get(ExportWatermark, consumer)
+        if watermark is None:  # reset while this run was writing
+            watermark = ExportWatermark(consumer=consumer, runs=0)
+            db.add(watermark)
+        watermark.last_activity_id = max_id
+        watermark.last_change_seq = max_seq
+        watermark.runs += 1
+        db.flush()
+        _prune_changes(db)
+
+    # Keep stdout clean when the export itself goes there.
+    print(f"Exported changes for {consumer} to {path}: {counts['insert']} new, {counts['update']} updated, "
+          f"{counts['delete']} deleted" + (", truncated" if counts["truncate"] else ""),
+          file=sys.stderr if path == "-" else sys.stdout)
+    return counts
+
+def _prune_changes(db: Session):
+    """Delete log entries every consumer has read (all of them when there are no consumers)."""
+    oldest = db.scalar(select(func.min(ExportWatermark.last_change_seq)))
+    query = delete(ActivityChange)
+    if oldest is not None:
+        query = query.where(ActivityChange.seq <= oldest)
+    db.execute(query)
+
+def reset_consumer(consumer: str):
+    """Forget consumer's watermark so its next export starts from scratch."""
+    with session_scope() as db:
+        db.execute(delete(ExportWatermark).where(ExportWatermark.consumer == consumer))
+        _prune_changes(db)
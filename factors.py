@@ -0,0 +1,174 @@
+import threading
+from array import array
+from bisect import bisect_right
+from itertools import compress
+from datetime import datetime
+from sqlalchemy import select
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+from models import EmissionFactor, session_scope
+
+# Built-in emission factors (kg CO2 per unit of quantity). They seed the
+# emission_factors table and are used as-is when that table is unavailable.
+EMISSION_FACTORS = {
+    "Driving": 0.170,  # kg CO2 per km (petrol car average)
+    "Flying Domestic": 0.246,  # kg CO2 per km
+    "Flying International": 0.154,  # kg CO2 per km (short-haul)
+    "Bus": 0.089,  # kg CO2 per km
+    "Train": 0.035,  # kg CO2 per km (national rail)
+    "Electricity": 0.475,  # kg CO2 per kWh (global average)
+}
+
+DEFAULT_FACTOR_SOURCE = "builtin"
+
+class FactorIndex:
+    """In-memory interval index over the emission_factors table.
+
+    For each activity type the intervals are kept as parallel lists sorted by
+    start, so finding the factor in force at a given moment is one bisect.
+    """
+
+    def __init__(self, rows):
+        grouped = {}
+        for activity_type, factor, valid_from, valid_to in rows:
+            grouped.setdefault(activity_type, []).append(
+                (valid_from or datetime.min, valid_to or datetime.max, factor)
+            )
+        self._starts = {}
+        self._ends = {}
+        self._factors = {}
+        for activity_type, intervals in grouped.items():
+            intervals.sort()
+            self._starts[activity_type] = [start for start, _, _ in intervals]
+            self._ends[activity_type] = [end for _, end, _ in intervals]
+            self._factors[activity_type] = [factor for _, _, factor in intervals]
+        self._by_lower = {activity_type.lower(): activity_type for activity_type in self._starts}
+
+    def lookup(self, activity_type: str, when: datetime = None):
+        """Factor in force for activity_type at `when` (default: now), or None."""
+        starts = self._starts.get(activity_type)
+        if starts is None:
+            return None
+        when = when or datetime.utcnow()
+        i = bisect_right(starts, when) - 1
+        if i >= 0 and when < self._ends[activity_type][i]:
+            return self._factors[activity_type][i]
+        return None
+
+    def _undated_factor(self, activity_type: str):
+        """Factor for a type whose value does not depend on the date.
+
+        Returns 0.0 for unknown types and None when the type has dated
+        intervals and needs a per-row lookup.
+        """
+        starts = self._starts.get(activity_type)
+        if starts is None:
+            return 0.0
+        if len(starts) == 1 and starts[0] == datetime.min and self._ends[activity_type][0] == datetime.max:
+            return self._factors[activity_type][0]
+        return None
+
+    def factors_for(self, activity_types, dates=None) -> array:
+        """Factor per row (0.0 where none applies) as a packed array('d').
+
+        Each distinct activity type is resolved to a factor once and the
+        column is filled with a C-level map; only rows whose type has dated
+        intervals get a bisect of their own.
+        """
+        activity_types = activity_types if isinstance(activity_types, list) else list(activity_types)
+        resolved = {activity_type: self._undated_factor(activity_type) for activity_type in set(activity_types)}
+        dated = {activity_type for activity_type, factor in resolved.items() if factor is None}
+        for activity_type in dated:
+            resolved[activity_type] = 0.0
+        factors = array("d", map(resolved.__getitem__, activity_types))
+        if dated:
+            now = datetime.utcnow()
+            seen = {}
+            for i in compress(range(len(activity_types)), map(dated.__contains__, activity_types)):
+                key = (activity_types[i], (dates[i] if dates is not None else None) or now)
+                factor = seen.get(key)
+                if factor is None:
+                    factor = seen[key] = self.lookup(*key) or 0.0
+                factors[i] = factor
+        return factors
+
+    def intervals(self, activity_type: str) -> list:
+        """(valid_from, valid_to, factor) tuples for a type, oldest first.
+
+        Open ends are reported as None, as they are stored in the table.
+        """
+        return [
+            (None if start == datetime.min else start, None if end == datetime.max else end, factor)
+            for start, end, factor in zip(self._starts.get(activity_type, []), self._ends.get(activity_type, []),
+                                          self._factors.get(activity_type, []))
+        ]
+
+    def activity_types(self) -> list:
+        return list(self._starts)
+
+    def match_type(self, name: str) -> str:
+        """The known type matching name case-insensitively, or name itself (stripped)."""
+        name = name.strip()
+        return self._by_lower.get(name.lower(), name)
+
+_index = None
+_index_lock = threading.Lock()
+
+def _load_rows():
+    try:
+        with session_scope() as session:
+            rows = session.execute(select(
+                EmissionFactor.activity_type, EmissionFactor.factor,
+                EmissionFactor.valid_from, EmissionFactor.valid_to,
+            )).all()
+    except DBAPIError:
+        rows = []
+    if not rows:
+        rows = [(activity_type, factor, None, None) for activity_type, factor in EMISSION_FACTORS.items()]
+    return rows
+
+def get_factor_index() -> FactorIndex:
+    """The process-wide factor index, loaded from the database on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = FactorIndex(_load_rows())
+    return _index
+
+def reload_factor_index():
+    """Drop the cached index so the next lookup reloads it from the database."""
+    global _index
+    with _index_lock:
+        _index = None
+
+def add_emission_factor(activity_type: str, factor: float, valid_from: datetime,
+                        source: str = None, session: Session = None):
+    """Put a new factor in force from valid_from onwards.
+
+    The factor currently open-ended for this activity type is closed at
+    valid_from, so activities dated before it keep their old factor.
+    """
+    try:
+        with session_scope(session) as db:
+            current = db.execute(
+                select(EmissionFactor)
+                .where(EmissionFactor.activity_type == activity_type, EmissionFactor.valid_to.is_(None))
+            ).scalars().all()
+            for row in current:
+                if row.valid_from is not None and row.valid_from >= valid_from:
+                    print(f"Error: a factor for {activity_type} already starts on {row.valid_from}.")
+                    return None
+                row.valid_to = valid_from
+            new_factor = EmissionFactor(
+                activity_type=activity_type, factor=factor, valid_from=valid_from, source=source
+            )
+            db.add(new_factor)
+        reload_factor_index()
+        print(f"Emission factor for {activity_type} set to {factor} from {valid_from:%Y-%m-%d}.\n")
+        return new_factor
+    except Exception as e:
+        if session is not None:
+            raise
+        print(f"Error adding emission factor: {e}\n")
+        return None
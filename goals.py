@@ -0,0 +1,136 @@
+"""Goal progress against recorded emissions.
+
+Goals are evaluated in bulk, never one query per goal: one read of the
+emissions_daily rollup, summed per user and day, builds a running total of
+each user's emissions, and one read of the goals table lists the goals. A
+goal's accrued emission (start_date up to the deadline or today, whichever
+comes first) is then the difference of two running totals found by binary
+search, so the cost is one pass over the rollup plus O(log days) per goal.
+
+Accrual is by whole days, like the rollup: everything on the goal's start
+day counts, including activities logged earlier that day than the goal was
+created.
+
+For each goal the evaluator reports the accrued emission, the share of the
+target used, the emission projected by the deadline at the current rate and
+any projected overshoot, and classifies it:
+
+    on_track     projected to stay within the target
+    at_risk      projected to exceed the target by the deadline
+    near_breach  GOAL_NEAR_BREACH_PERCENT (default 90) or more of the target used
+    breached     the target has been used up
+"""
+import os
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime
+from sqlalchemy import func, or_, select
+from sqlalchemy.orm import Session
+from models import EmissionDaily, Goal, session_scope
+
+NEAR_BREACH_PERCENT = float(os.getenv("GOAL_NEAR_BREACH_PERCENT", 90))
+# In increasing order of severity.
+STATUSES = ("on_track", "at_risk", "near_breach", "breached")
+
+def goals_query(as_of: datetime, user_ids=None, include_expired: bool = False):
+    """Goals (of user_ids, if given) still running at `as_of`, or all of them with include_expired."""
+    query = select(Goal.id, Goal.user_id, Goal.description, Goal.target_emission,
+                   Goal.start_date, Goal.deadline).order_by(Goal.id)
+    if user_ids is not None:
+        query = query.where(Goal.user_id.in_(user_ids))
+    if not include_expired:
+        today = datetime.combine(as_of.date(), datetime.min.time())
+        query = query.where(or_(Goal.deadline.is_(None), Goal.deadline >= today))
+    return query
+
+def daily_totals_query(as_of: datetime, user_ids=None):
+    """(user_id, day, emission) up to `as_of`, ordered by user and day."""
+    query = (
+        select(EmissionDaily.user_id, EmissionDaily.day, func.sum(EmissionDaily.total_emission))
+        .where(EmissionDaily.day <= as_of.date())
+        .group_by(EmissionDaily.user_id, EmissionDaily.day)
+        .order_by(EmissionDaily.user_id, EmissionDaily.day)
+    )
+    if user_ids is not None:
+        query = query.where(EmissionDaily.user_id.in_(user_ids))
+    return query
+
+def _running_totals(rows) -> dict:
+    """user_id -> (days, totals), where totals[i] is the emission before days[i]."""
+    series = {}
+    for user_id, day, emission in rows:
+        entry = series.get(user_id)
+        if entry is None:
+            entry = series[user_id] = ([], [0.0])
+        entry[0].append(day)
+        entry[1].append(entry[1][-1] + (emission or 0.0))
+    return series
+
+def _accrued(series: dict, user_id: int, first: date, last: date) -> tuple:
+    """(emission, first day with any) for user_id over [first, last]; either bound may be None."""
+    if user_id not in series:
+        return 0.0, None
+    days, totals = series[user_id]
+    lo = bisect_left(days, first) if first else 0
+    hi = bisect_right(days, last) if last else len(days)
+    if lo >= hi:
+        return 0.0, None
+    return totals[hi] - totals[lo], days[lo]
+
+def _progress(row, as_of: datetime) -> dict:
+    goal_id, user_id, description, target, start_date, deadline, accrued, first_day = row
+    target = target or 0.0
+    today = as_of.date()
+    start = start_date.date() if start_date else (first_day or today)
+    end = min(today, deadline.date()) if deadline else today
+    elapsed_days = max((end - start).days + 1, 1)
+    if deadline:
+        total_days = max((deadline.date() - start).days + 1, 1)
+        projected = accrued / elapsed_days * total_days
+    else:
+        projected = accrued
+    # Undefined (None) for emissions against a zero target; such a goal is breached.
+    percent_used = accrued / target * 100 if target > 0 else (0.0 if accrued <= 0 else None)
+
+    if accrued > 0 and accrued >= target:
+        status = "breached"
+    elif percent_used >= NEAR_BREACH_PERCENT:
+        status = "near_breach"
+    elif projected > target:
+        status = "at_risk"
+    else:
+        status = "on_track"
+    return {
+        "goal_id": goal_id,
+        "user_id": user_id,
+        "description": description,
+        "target_emission": target,
+        "start_date": start_date,
+        "deadline": deadline,
+        "accrued_emission": accrued,
+        "percent_used": percent_used,
+        "projected_emission": projected,
+        "projected_overshoot": max(projected - target, 0.0),
+        "status": status,
+    }
+
+def evaluate_goals(user_ids=None, as_of: datetime = None, include_expired: bool = False,
+                   session: Session = None) -> list:
+    """Progress of every active goal (of user_ids, if given), in goal id order."""
+    as_of = as_of or datetime.utcnow()
+    if user_ids is not None:
+        user_ids = list(user_ids)
+    with session_scope(session) as db:
+        # Core rather than ORM execution: these are plain tuples, and plenty of them.
+        connection = db.connection()
+        goals = connection.execute(goals_query(as_of, user_ids, include_expired)).all()
+        if not goals:
+            return []
+        series = _running_totals(connection.execute(daily_totals_query(as_of, user_ids)))
+    progress = []
+    for goal_id, user_id, description, target, start_date, deadline in goals:
+        first = start_date.date() if start_date else None
+        last = deadline.date() if deadline else None
+        accrued, first_day = _accrued(series, user_id, first, last)
+        progress.append(_progress((goal_id, user_id, description, target, start_date, deadline,
+                                   accrued, first_day), as_of))
+    return progress
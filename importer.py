@@ -0,0 +1,235 @@
+"""Streaming activity importer for CSV and JSON Lines files.
+
+The import is a generator pipeline, so memory use does not grow with the
+file size:
+
+    read_records -> normalize_records -> batched -> add_activities_bulk
+
+Each batch is inserted in the same transaction that advances the file's
+checkpoint (byte offset of the last committed record plus batch/row counts),
+so an interrupted import resumes exactly where it stopped. Records that
+cannot be read or parsed are reported and skipped; they never stop the
+import. A completed import deletes its checkpoint.
+
+CSV files need a header row with at least user_id, activity_type and
+quantity; unit, emission and activity_date are optional. Quoted fields may not
+span lines. JSONL files hold one object per line with the same keys. Activity
+types are matched case-insensitively against the emission factor registry.
+
+    python importer.py activities.csv --batch-size 10000
+"""
+import argparse
+import csv
+import json
+import os
+import time
+from datetime import datetime, timezone
+from itertools import islice
+from factors import get_factor_index
+from models import Checkpoint, session_scope
+from operations import add_activities_bulk
+
+DEFAULT_BATCH_SIZE = 10000
+DATE_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d")
+
+def checkpoint_name(path: str) -> str:
+    return f"import:{os.path.abspath(path)}"
+
+def _decode_json(text: str):
+    """The object on a JSONL line, or the error that makes it unusable."""
+    try:
+        record = json.loads(text)
+    except json.JSONDecodeError as e:
+        return ValueError(f"invalid JSON: {e}")
+    if not isinstance(record, dict):
+        return ValueError(f"expected a JSON object, got {type(record).__name__}")
+    return record
+
+def read_records(path: str, start_offset: int = 0):
+    """Yield (end_offset, record) for each record, starting at start_offset.
+
+    end_offset is the byte position just after the record, i.e. where a
+    resumed import would start reading. A line that cannot be decoded is
+    yielded as the ValueError describing it, so it is rejected and the
+    checkpoint still moves past it.
+    """
+    is_csv = path.lower().endswith(".csv")
+    with open(path, "rb") as f:
+        header = None
+        if is_csv:
+            header = next(csv.reader([f.readline().decode("utf-8-sig")]))
+            header = [name.strip() for name in header]
+        if start_offset > f.tell():
+            f.seek(start_offset)
+        while True:
+            line = f.readline()
+            if not line:
+                break
+            try:
+                text = line.decode("utf-8").strip()
+            except UnicodeDecodeError as e:
+                yield f.tell(), ValueError(f"invalid UTF-8: {e}")
+                continue
+            if not text:
+                continue
+            if is_csv:
+                try:
+                    record = dict(zip(header, next(csv.reader([text]))))
+                except csv.Error as e:
+                    record = ValueError(f"invalid CSV: {e}")
+            else:
+                record = _decode_json(text)
+            yield f.tell(), record
+
+def _parse_date_string(value: str) -> datetime:
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        pass
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"unrecognised date {value!r}")
+
+def _parse_date(value):
+    """Parse an activity date; dates with a UTC offset become naive UTC like every stored date."""
+    if not value:
+        return None
+    if not isinstance(value, datetime):
+        value = _parse_date_string(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def normalize_records(records):
+    """Convert raw string fields to typed activity rows.
+
+    Yields (end_offset, row, error); row is None when the record could not be
+    parsed and error says why.
+    """
+    for offset, record in records:
+        if isinstance(record, ValueError):
+            yield offset, None, str(record)
+            continue
+        try:
+            emission = record.get("emission")
+            unit = record.get("unit") or None
+            if unit is not None and not isinstance(unit, str):
+                raise TypeError(f"unit must be a string, not {unit!r}")
+            row = {
+                "user_id": int(record["user_id"]),
+                "activity_type": str(record["activity_type"]).strip(),
+                "quantity": float(record["quantity"]),
+                "unit": unit,
+                "emission": float(emission) if emission not in (None, "") else None,
+                "activity_date": _parse_date(record.get("activity_date")),
+            }
+        except (KeyError, TypeError, ValueError) as e:
+            yield offset, None, f"unparseable record: {e}"
+            continue
+        yield offset, row, None
+
+def batched(items, size: int):
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def import_activities(path: str, batch_size: int = DEFAULT_BATCH_SIZE, restart: bool = False) -> dict:
+    """Import activities from a CSV or JSONL file, resuming from its checkpoint.
+
+    Returns totals for this run: {"inserted", "rejected", "batches", "offset"}.
+    """
+    name = checkpoint_name(path)
+    with session_scope() as session:
+        checkpoint = session.get(Checkpoint, name)
+        if checkpoint is None:
+            checkpoint = Checkpoint(name=name, position=0, batches=0, rows=0)
+            session.add(checkpoint)
+        elif restart:
+            checkpoint.position = checkpoint.batches = checkpoint.rows = 0
+        start_offset = checkpoint.position
+
+    if start_offset:
+        print(f"Resuming {path} from byte {start_offset} ({checkpoint.rows} rows already imported)")
+
+    records = normalize_records(read_records(path, start_offset))
+    totals = _import_batches(records, batch_size, name, start_offset)
+    # Done: drop the checkpoint so importing the file again starts from the top.
+    with session_scope() as session:
+        checkpoint = session.get(Checkpoint, name)
+        if checkpoint is not None:
+            session.delete(checkpoint)
+    print(f"Import of {path} complete: {totals['inserted']} rows imported, {totals['rejected']} rejected.")
+    return totals
+
+def read_stream(stream, is_csv: bool = False):
+    """Yield (None, record) for each record of a text stream such as stdin."""
+    lines = (line for line in stream if line.strip())
+    if is_csv:
+        for record in csv.DictReader(lines):
+            yield None, {name.strip(): value for name, value in record.items()}
+    else:
+        for line in lines:
+            yield None, _decode_json(line)
+
+def import_stream(stream, is_csv: bool = False, batch_size: int = DEFAULT_BATCH_SIZE) -> dict:
+    """Import activities from a text stream. Streams cannot be re-read, so
+    no checkpoint is kept; each batch still commits on its own."""
+    totals = _import_batches(normalize_records(read_stream(stream, is_csv)), batch_size)
+    print(f"Import complete: {totals['inserted']} rows imported, {totals['rejected']} rejected.")
+    return totals
+
+def _import_batches(records, batch_size: int, name: str = None, start_offset: int = 0) -> dict:
+    """Insert normalized records batch by batch, advancing checkpoint `name` if given."""
+    totals = {"inserted": 0, "rejected": 0, "batches": 0, "offset": start_offset}
+    started = time.perf_counter()
+    seen = 0
+    for batch in batched(records, batch_size):
+        rows = [row for _, row, _ in batch if row is not None]
+        # Type names match the registry case-insensitively, as on the command line.
+        factor_index = get_factor_index()
+        for row in rows:
+            row["activity_type"] = factor_index.match_type(row["activity_type"])
+        # Record number (1-based, within this run) and end offset of each row in `rows`.
+        row_records = [(seen + i + 1, offset) for i, (offset, row, _) in enumerate(batch) if row is not None]
+        errors = [(seen + i + 1, offset, error) for i, (offset, row, error) in enumerate(batch) if row is None]
+        seen += len(batch)
+        end_offset = batch[-1][0]
+        with session_scope() as session:
+            report = add_activities_bulk(rows, chunk_size=batch_size, session=session)
+            if name is not None:
+                checkpoint = session.get(Checkpoint, name)
+                checkpoint.position = end_offset
+                checkpoint.batches += 1
+                checkpoint.rows += report["inserted"]
+
+        totals["inserted"] += report["inserted"]
+        errors.extend((*row_records[index], reason) for index, reason in report["rejected"])
+        for number, offset, reason in sorted(errors):
+            where = f"record {number}" + (f" (ends at byte {offset})" if offset is not None else "")
+            print(f"  Rejected {where}: {reason}")
+        totals["rejected"] += len(errors)
+        totals["batches"] += 1
+        totals["offset"] = end_offset
+        elapsed = time.perf_counter() - started
+        rate = totals["inserted"] / elapsed if elapsed > 0 else 0.0
+        batch_number = checkpoint.batches if name is not None else totals["batches"]
+        print(f"Batch {batch_number}: {totals['inserted']} rows imported, "
+              f"{totals['rejected']} rejected, {rate:.0f} rows/s")
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description="Import activities from a CSV or JSONL file")
+    parser.add_argument("path")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--restart", action="store_true", help="ignore any saved checkpoint and start over")
+    args = parser.parse_args()
+    import_activities(args.path, batch_size=args.batch_size, restart=args.restart)
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,30 @@
-from operations import add_user, add_activity, list_activities, list_users, display_emissions_bar_chart, delete_user, EMISSION_FACTORS, add_goal, list_goals, delete_all_activities, verify_user, export_activities_to_json
-from models import SessionLocal, User
-from tabulate import tabulate
+from operations import add_user, add_activity, list_activities, list_users, display_emissions_bar_chart, delete_user, calculate_emission, add_goal, list_goals, delete_all_activities, verify_user, export_activities_to_json, get_all_users
+from models import engine
+from migrations import schema_is_current
+from factors import get_factor_index
 from datetime import datetime
-import json
-import os
+from session_store import get_session_store
+from monitor import monitor_from_env
 
-def save_session(username):
-    """Save session data to a file."""
-    try:
-        with open("session.json", "w") as f:
-            json.dump({"username": username}, f)
-        print("Session saved successfully.")
-    except Exception as e:
-        print(f"Error saving session: {e}")
-
-def load_session():
-    """Load session data."""
+def main():
+    if not schema_is_current(engine):
+        print("Database schema is missing or out of date.")
+        print("Run `python migrations.py init` to create or upgrade it.")
+        return
+    sessions = get_session_store()
+    monitor = monitor_from_env()
+    if monitor:
+        monitor.start()
     try:
-        with open("session.json", "r") as f:
-            return json.load(f).get("username")
-    except (FileNotFoundError, json.JSONDecodeError):
-        return None
+        run_menu(sessions)
+    finally:
+        if monitor:
+            monitor.stop()
 
-def clear_session():
-    """Clear session data."""
-    if os.path.exists("session.json"):
-        try:
-            os.remove("session.json")
-            print("Session cleared successfully.")
-        except Exception as e:
-            print(f"Error clearing session: {e}")
-
-def main():
+def run_menu(sessions):
+    token = None
     while True:
-        current_user = load_session()
+        current_user = sessions.resolve(token) if token else None
         print("EcoTracker Menu")
         print("1. Log in")
         print("2. Sign Up")
@@ -68,7 +59,7 @@ def main():
                 print("===============================")
                 continue
             if verify_user(username, password):
-                save_session(username)
+                token = sessions.create(username)
                 print(f"User {username} logged in successfully.")
             else:
                 print("Invalid username or password.")
@@ -92,9 +83,8 @@ def main():
                 continue
 
             if choice == "3":
-                session = SessionLocal()
                 try:
-                    users = session.query(User).all()
+                    users = get_all_users()
                     if not users:
                         print("No users found! Please add a user first.\n")
                         continue
@@ -107,7 +97,7 @@ def main():
                         continue
                     user_id = int(user_id)
                     
-                    print("Available activity types:", ", ".join(EMISSION_FACTORS.keys()))
+                    print("Available activity types:", ", ".join(get_factor_index().activity_types()))
                     activity_type = input("Input Activity Type: ").strip()
                     if not activity_type:
                         print("Activity type cannot be empty!\n")
@@ -123,8 +113,8 @@ def main():
                         print("Quantity must be a number!\n")
                         continue
                     
-                    if activity_type in EMISSION_FACTORS:
-                        calculated_emission = EMISSION_FACTORS[activity_type] * quantity
+                    calculated_emission = calculate_emission(activity_type, quantity)
+                    if calculated_emission:
                         print(f"Auto-calculated emission: {calculated_emission:.2f} kg CO2")
                         override = input("Use this value? (y/n): ").strip().lower()
                         if override == 'n':
@@ -153,7 +143,6 @@ def main():
                     
                     add_activity(user_id, activity_type, quantity, emission)
                 finally:
-                    session.close()
                     print("===============================")
         
             elif choice == "4":
@@ -169,9 +158,8 @@ def main():
                 print("===============================")
         
             elif choice == "7":
-                session = SessionLocal()
                 try:
-                    users = session.query(User).all()
+                    users = get_all_users()
                     if not users:
                         print("No users found! Please add a user first.\n")
                         continue
@@ -199,7 +187,6 @@ def main():
                         continue
                     add_goal(user_id, description, target_emission, deadline_dt)
                 finally:
-                    session.close()
                     print("===============================")
         
             elif choice == "8":
@@ -207,9 +194,8 @@ def main():
                 print("===============================")
         
             elif choice == "9":
-                session = SessionLocal()
                 try:
-                    users = session.query(User).all()
+                    users = get_all_users()
                     if not users:
                         print("No users found!\n")
                         continue
@@ -222,12 +208,11 @@ def main():
                         print("User ID must be a number!\n")
                         continue
                     user_id = int(user_id)
-                    if session.query(User).filter_by(id=user_id, username=current_user).first():
+                    if any(user.id == user_id and user.username == current_user for user in users):
                         print("Cannot delete the currently logged-in user!")
                         continue
                     delete_user(user_id)
                 finally:
-                    session.close()
                     print("===============================")
         
             elif choice == "10":
@@ -245,7 +230,8 @@ def main():
 
         elif choice == "12":
             if current_user:
-                clear_session()
+                sessions.revoke(token)
+                token = None
                 print("Logged out successfully.")
                 print("===============================")
             else:
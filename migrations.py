@@ -0,0 +1,224 @@
+import argparse
+from sqlalchemy import text, insert, select, func, inspect
+from sqlalchemy.engine import Engine, Connection
+from sqlalchemy.exc import DBAPIError
+from models import (Base, Activity, ActivityChange, AuthSession, Checkpoint, EmissionDaily, EmissionFactor,
+                    ExportWatermark, LoginFailure, engine as default_engine)
+from factors import EMISSION_FACTORS, DEFAULT_FACTOR_SOURCE
+from rollups import rebuild_rollups
+
+# Versioned schema migrations. Each entry runs exactly once per database, in
+# order, and the highest applied version is stored in the schema_version table.
+# Migrations must be idempotent (IF NOT EXISTS etc.) because a fresh database
+# already gets the current schema from Base.metadata.create_all.
+#
+# Schema changes only happen through init_db()/migrate() (run
+# `python migrations.py init`); normal startup just calls schema_is_current().
+
+def _get_version(conn: Connection) -> int:
+    conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+    version = conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar()
+    return version or 0
+
+def _set_version(conn: Connection, version: int):
+    conn.execute(text("DELETE FROM schema_version"))
+    conn.execute(text("INSERT INTO schema_version (version) VALUES (:v)"), {"v": version})
+
+def _has_foreign_key(conn: Connection, table: str) -> bool:
+    return bool(conn.execute(text(f"PRAGMA foreign_key_list({table})")).fetchall())
+
+def _rebuild_with_foreign_key(conn: Connection, table: str, create_sql: str, columns: str):
+    """Recreate a SQLite table so it carries the foreign key declared on the model.
+
+    SQLite cannot add a constraint to an existing table, so the rows are copied
+    into a new table which then replaces the old one.
+    """
+    if conn.dialect.name != "sqlite" or _has_foreign_key(conn, table):
+        return
+    conn.execute(text(f"DROP TABLE IF EXISTS {table}_new"))
+    conn.execute(text(create_sql.format(table=f"{table}_new")))
+    conn.execute(text(f"INSERT INTO {table}_new ({columns}) SELECT {columns} FROM {table}"))
+    conn.execute(text(f"DROP TABLE {table}"))
+    conn.execute(text(f"ALTER TABLE {table}_new RENAME TO {table}"))
+
+def _migration_1_foreign_keys(conn: Connection):
+    _rebuild_with_foreign_key(
+        conn,
+        "activities",
+        """CREATE TABLE {table} (
+            id INTEGER NOT NULL,
+            user_id INTEGER,
+            activity_type VARCHAR,
+            quantity FLOAT,
+            emission FLOAT,
+            activity_date DATETIME,
+            PRIMARY KEY (id),
+            FOREIGN KEY(user_id) REFERENCES users (id)
+        )""",
+        "id, user_id, activity_type, quantity, emission, activity_date",
+    )
+    _rebuild_with_foreign_key(
+        conn,
+        "goals",
+        """CREATE TABLE {table} (
+            id INTEGER NOT NULL,
+            user_id INTEGER,
+            description VARCHAR,
+            target_emission FLOAT,
+            deadline DATETIME,
+            PRIMARY KEY (id),
+            FOREIGN KEY(user_id) REFERENCES users (id)
+        )""",
+        "id, user_id, description, target_emission, deadline",
+    )
+
+def _migration_2_activity_indexes(conn: Connection):
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_activities_user_date ON activities (user_id, activity_date)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_activities_type_date ON activities (activity_type, activity_date)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_goals_user_id ON goals (user_id)"))
+
+def _migration_3_checkpoints(conn: Connection):
+    Checkpoint.__table__.create(conn, checkfirst=True)
+
+def _migration_4_emissions_daily(conn: Connection):
+    EmissionDaily.__table__.create(conn, checkfirst=True)
+    rebuild_rollups(conn)
+
+def _migration_5_activity_date_index(conn: Connection):
+    # Serves the (activity_date, id) ordering of activity listings; SQLite
+    # indexes carry the rowid, so id is covered as the tie-breaker.
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_activities_date ON activities (activity_date)"))
+
+def _migration_6_emission_factors(conn: Connection):
+    EmissionFactor.__table__.create(conn, checkfirst=True)
+    if conn.execute(select(func.count()).select_from(EmissionFactor.__table__)).scalar():
+        return
+    conn.execute(insert(EmissionFactor.__table__), [
+        {"activity_type": activity_type, "factor": factor, "source": DEFAULT_FACTOR_SOURCE}
+        for activity_type, factor in EMISSION_FACTORS.items()
+    ])
+
+def _add_column(conn: Connection, table: str, column: str, ddl_type: str):
+    if column not in {c["name"] for c in inspect(conn).get_columns(table)}:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+
+def _migration_7_activity_source_units(conn: Connection):
+    _add_column(conn, "activities", "source_quantity", "FLOAT")
+    _add_column(conn, "activities", "source_unit", "VARCHAR")
+
+def _migration_8_login_failures(conn: Connection):
+    LoginFailure.__table__.create(conn, checkfirst=True)
+
+def _migration_9_auth_sessions(conn: Connection):
+    AuthSession.__table__.create(conn, checkfirst=True)
+
+def _migration_10_incremental_export(conn: Connection):
+    # SQLite hands out max(id) + 1, so deleting the newest activities would
+    # let their ids be reused; AUTOINCREMENT needs the table to be rebuilt.
+    if conn.dialect.name == "sqlite":
+        create_sql = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'activities'")).scalar()
+        if "AUTOINCREMENT" not in create_sql.upper():
+            if inspect(conn).has_table("activities_old"):
+                raise RuntimeError("Table activities_old is left over from an interrupted rebuild of activities; "
+                                   "restore or drop it before migrating.")
+            # user_id is NOT NULL in the rebuilt table, so rows without a user
+            # are set aside rather than failing the copy.
+            orphans = conn.execute(text("SELECT COUNT(*) FROM activities WHERE user_id IS NULL")).scalar()
+            if orphans:
+                conn.execute(text("CREATE TABLE IF NOT EXISTS activities_without_user AS SELECT * FROM activities WHERE 0"))
+                conn.execute(text("INSERT INTO activities_without_user SELECT * FROM activities WHERE user_id IS NULL"))
+                conn.execute(text("DELETE FROM activities WHERE user_id IS NULL"))
+                print(f"Moved {orphans} activities without a user to the activities_without_user table.")
+            columns = ", ".join(column.name for column in Activity.__table__.columns)
+            conn.execute(text("ALTER TABLE activities RENAME TO activities_old"))
+            for index in Activity.__table__.indexes:
+                conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+            Activity.__table__.create(conn)
+            conn.execute(text(f"INSERT INTO activities ({columns}) SELECT {columns} FROM activities_old"))
+            conn.execute(text("DROP TABLE activities_old"))
+    ActivityChange.__table__.create(conn, checkfirst=True)
+    ExportWatermark.__table__.create(conn, checkfirst=True)
+
+def _migration_11_goal_start_date(conn: Connection):
+    _add_column(conn, "goals", "start_date", "DATETIME")
+
+MIGRATIONS = [
+    (1, "Add missing foreign keys to activities and goals", _migration_1_foreign_keys),
+    (2, "Index activities by (user_id, activity_date) and (activity_type, activity_date)", _migration_2_activity_indexes),
+    (3, "Add checkpoints table for resumable imports", _migration_3_checkpoints),
+    (4, "Add emissions_daily rollup and backfill it from activities", _migration_4_emissions_daily),
+    (5, "Index activities by activity_date for keyset listing", _migration_5_activity_date_index),
+    (6, "Add emission_factors registry seeded with the built-in factors", _migration_6_emission_factors),
+    (7, "Record the original quantity and unit of converted activities", _migration_7_activity_source_units),
+    (8, "Add login_failures table for the persisted login throttle", _migration_8_login_failures),
+    (9, "Add auth_sessions table for the shared session store", _migration_9_auth_sessions),
+    (10, "Never reuse activity ids; add activity_changes log and export_watermarks", _migration_10_incremental_export),
+    (11, "Record when each goal starts counting emissions", _migration_11_goal_start_date),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def _apply_migrations(conn: Connection, verbose: bool) -> int:
+    current = _get_version(conn)
+    for version, description, apply in MIGRATIONS:
+        if version <= current:
+            continue
+        if verbose:
+            print(f"Applying migration {version}: {description}")
+        apply(conn)
+        _set_version(conn, version)
+        current = version
+    return current
+
+def migrate(engine: Engine, verbose: bool = False) -> int:
+    """Apply every pending migration in one transaction and return the resulting schema version."""
+    if engine.dialect.name != "sqlite":
+        with engine.begin() as conn:
+            return _apply_migrations(conn, verbose)
+    # pysqlite only opens a transaction before INSERT/UPDATE/DELETE, so DDL
+    # (table rebuilds, CREATE, ALTER) would be committed as it runs. With the
+    # driver in autocommit mode an explicit BEGIN covers the DDL too, and a
+    # failed migration leaves the schema as it was.
+    with engine.connect() as conn:
+        conn.execution_options(isolation_level="AUTOCOMMIT")
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        try:
+            current = _apply_migrations(conn, verbose)
+        except BaseException:
+            conn.exec_driver_sql("ROLLBACK")
+            raise
+        conn.exec_driver_sql("COMMIT")
+    return current
+
+def get_schema_version(engine: Engine) -> int:
+    """Read the stored schema version without touching the schema (0 if never initialised)."""
+    try:
+        with engine.connect() as conn:
+            return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+    except DBAPIError:
+        return 0
+
+def schema_is_current(engine: Engine) -> bool:
+    return get_schema_version(engine) == LATEST_VERSION
+
+def init_db(engine: Engine = None, verbose: bool = False) -> int:
+    """Create any missing tables, then apply pending migrations."""
+    engine = engine or default_engine
+    Base.metadata.create_all(engine)
+    return migrate(engine, verbose=verbose)
+
+def main():
+    parser = argparse.ArgumentParser(description="EcoTracker database schema management")
+    parser.add_argument("command", choices=["init", "migrate", "status"])
+    args = parser.parse_args()
+
+    if args.command == "status":
+        version = get_schema_version(default_engine)
+        state = "up to date" if version == LATEST_VERSION else "needs migration"
+        print(f"Schema version {version} of {LATEST_VERSION} ({state})")
+        return
+    version = init_db(verbose=True)
+    print(f"Database is at schema version {version}.")
+
+if __name__ == "__main__":
+    main()
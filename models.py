@@ -1,7 +1,9 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import sessionmaker, relationship, Session
+from contextlib import contextmanager
 from datetime import datetime
+from database import make_engine
 
 Base = declarative_base()
 
@@ -18,27 +20,147 @@ class User(Base):
 
 class Activity(Base):
     __tablename__ = "activities"
+    __table_args__ = (
+        Index("ix_activities_user_date", "user_id", "activity_date"),
+        Index("ix_activities_type_date", "activity_type", "activity_date"),
+        Index("ix_activities_date", "activity_date"),
+        # Ids are never reused, so incremental exports can use them as a watermark.
+        {"sqlite_autoincrement": True},
+    )
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     activity_type = Column(String)
     quantity = Column(Float)
     emission = Column(Float)
     activity_date = Column(DateTime, default=datetime.utcnow)
+    # quantity is always in the activity type's canonical unit (see units.py);
+    # these keep what was originally submitted when it arrived in another unit.
+    source_quantity = Column(Float)
+    source_unit = Column(String)
     
     # Relationship
     user = relationship("User", back_populates="activities")
 
 class Goal(Base):
     __tablename__ = "goals"
+    __table_args__ = (
+        Index("ix_goals_user_id", "user_id"),
+    )
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     description = Column(String)
     target_emission = Column(Float)
+    # Emissions count towards the goal from this date; NULL (goals created
+    # before it was recorded) counts the user's whole history.
+    start_date = Column(DateTime, default=datetime.utcnow)
     deadline = Column(DateTime)
     
     # Relationship
     user = relationship("User", back_populates="goals")
 
-engine = create_engine("sqlite:///ecotracker.db")
-Base.metadata.create_all(engine)
-SessionLocal = sessionmaker(bind=engine)
\ No newline at end of file
+class EmissionDaily(Base):
+    """Per user, activity type and day totals, kept in step with activities."""
+    __tablename__ = "emissions_daily"
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    activity_type = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+    total_quantity = Column(Float, nullable=False, default=0.0)
+    total_emission = Column(Float, nullable=False, default=0.0)
+    count = Column(Integer, nullable=False, default=0)
+
+class EmissionFactor(Base):
+    """kg CO2 per unit for an activity type, in force over [valid_from, valid_to).
+
+    A NULL valid_from means "since always" and a NULL valid_to means "still in
+    force". Intervals for the same activity type must not overlap.
+    """
+    __tablename__ = "emission_factors"
+    __table_args__ = (
+        Index("ix_emission_factors_type_from", "activity_type", "valid_from"),
+    )
+    id = Column(Integer, primary_key=True)
+    activity_type = Column(String, nullable=False)
+    factor = Column(Float, nullable=False)
+    valid_from = Column(DateTime)
+    valid_to = Column(DateTime)
+    source = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class Checkpoint(Base):
+    """Progress marker for resumable jobs such as file imports."""
+    __tablename__ = "checkpoints"
+    name = Column(String, primary_key=True)
+    position = Column(Integer, nullable=False, default=0)
+    batches = Column(Integer, nullable=False, default=0)
+    rows = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class LoginFailure(Base):
+    """A failed login, kept only for the throttle's sliding window."""
+    __tablename__ = "login_failures"
+    __table_args__ = (
+        Index("ix_login_failures_key_time", "key", "attempted_at"),
+    )
+    id = Column(Integer, primary_key=True)
+    key = Column(String, nullable=False)
+    attempted_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+class AuthSession(Base):
+    """A login session, shared between processes by the database session store."""
+    __tablename__ = "auth_sessions"
+    __table_args__ = (
+        Index("ix_auth_sessions_expires_at", "expires_at"),
+    )
+    id = Column(String, primary_key=True)
+    username = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False)
+
+class ActivityChange(Base):
+    """Log of updated and deleted activities, read by incremental exports.
+
+    op is "update" or "delete" for activity_id, or "truncate" when every
+    activity up to activity_id was deleted at once.
+    """
+    __tablename__ = "activity_changes"
+    __table_args__ = {"sqlite_autoincrement": True}
+    seq = Column(Integer, primary_key=True)
+    activity_id = Column(Integer, nullable=False)
+    op = Column(String, nullable=False)
+    changed_at = Column(DateTime, default=datetime.utcnow)
+
+class ExportWatermark(Base):
+    """How far an incremental export consumer has read."""
+    __tablename__ = "export_watermarks"
+    consumer = Column(String, primary_key=True)
+    last_activity_id = Column(Integer, nullable=False, default=0)
+    last_change_seq = Column(Integer, nullable=False, default=0)
+    runs = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+engine = make_engine()
+# expire_on_commit=False keeps objects usable after their unit of work has
+# committed and closed (e.g. the users returned by get_all_users).
+SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+
+@contextmanager
+def session_scope(session: Session = None):
+    """Unit of work: one session, one transaction, one commit.
+
+    With no argument a new session is opened, committed when the block exits
+    cleanly, rolled back on error and closed. When an existing session is
+    passed it is yielded as-is, so the caller's own session_scope decides when
+    to commit; this is what lets several operations share one transaction.
+    """
+    if session is not None:
+        yield session
+        return
+    session = SessionLocal()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
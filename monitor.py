@@ -0,0 +1,233 @@
+"""Background goal monitoring driven by changed users, not by goal count.
+
+The monitor subscribes to change notifications (changes.subscribe), so every
+committed add_activity, bulk import chunk, recalculation chunk, delete and
+add_goal marks its users dirty. Each tick takes up to GOAL_MONITOR_BATCH_SIZE
+dirty users, evaluates just their goals (goals.evaluate_goals) and compares
+each goal's status with the last one seen. A goal that moves into near_breach or
+breached produces an event for every sink. Quiet users are never revisited,
+so the cost of monitoring follows write volume.
+
+A sink is any callable taking the event dict; LogSink and JsonlSink append
+to files:
+
+    monitor = GoalMonitor([LogSink("goals.log"), JsonlSink("goal-events.jsonl"), print])
+    monitor.start()
+    ...
+    monitor.stop()
+
+Only writes made in this process are seen. On start the monitor records the
+current status of every running goal without raising events, so restarting
+it does not repeat old breaches.
+
+Settings: GOAL_MONITOR_INTERVAL (seconds between ticks, default 60),
+GOAL_MONITOR_BATCH_SIZE (users per evaluation, 500). main.py starts a
+monitor when GOAL_MONITOR_LOG and/or GOAL_MONITOR_JSONL name files to write.
+"""
+import json
+import os
+import threading
+from datetime import datetime
+from sqlalchemy import select
+import changes
+from goals import evaluate_goals
+from models import Goal, session_scope
+from utils import json_default
+
+DEFAULT_INTERVAL = float(os.getenv("GOAL_MONITOR_INTERVAL", 60))
+DEFAULT_BATCH_SIZE = int(os.getenv("GOAL_MONITOR_BATCH_SIZE", 500))
+# Statuses that raise an event when a goal moves into them.
+ALERT_STATUSES = ("near_breach", "breached")
+
+class LogSink:
+    """Append one human-readable line per event to a log file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, event: dict):
+        percent = "" if event["percent_used"] is None else f" ({event['percent_used']:.1f}%)"
+        line = (f"{event['at']} goal {event['goal_id']} (user {event['user_id']}, {event['description']}) "
+                f"{event['previous_status']} -> {event['status']}: {event['accrued_emission']:.2f} of "
+                f"{event['target_emission']:.2f} kg CO2 used{percent}, "
+                f"projected {event['projected_emission']:.2f}\n")
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+class JsonlSink:
+    """Append each event to a JSON Lines file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, event: dict):
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(event, default=json_default) + "\n")
+
+class GoalMonitor:
+    """Re-evaluates the goals of users whose activities changed and reports new breaches."""
+
+    def __init__(self, sinks=(), interval: float = DEFAULT_INTERVAL, batch_size: int = DEFAULT_BATCH_SIZE):
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        self.sinks = list(sinks)
+        self.interval = interval
+        self.batch_size = batch_size
+        self._dirty = set()
+        self._all_dirty = False
+        self._lock = threading.Lock()
+        # user_id -> {goal_id: last status seen}
+        self._statuses = {}
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        self._subscribed = False
+        self._ticks = 0
+        self._users_evaluated = 0
+        self._goals_evaluated = 0
+        self._events = 0
+        self._errors = 0
+
+    def _on_change(self, user_ids: set, all_users: bool):
+        with self._lock:
+            if all_users:
+                self._all_dirty = True
+            else:
+                self._dirty.update(user_ids)
+
+    def mark_dirty(self, user_ids=None):
+        """Queue user_ids (None: every user with a goal) for the next tick, e.g. after editing goals."""
+        self._on_change(set(user_ids or ()), user_ids is None)
+
+    def subscribe(self):
+        """Start collecting dirty users from change notifications."""
+        if not self._subscribed:
+            changes.subscribe(self._on_change)
+            self._subscribed = True
+
+    def prime(self):
+        """Record every running goal's current status without raising events."""
+        statuses = {}
+        for progress in evaluate_goals():
+            statuses.setdefault(progress["user_id"], {})[progress["goal_id"]] = progress["status"]
+        with self._lock:
+            self._statuses = statuses
+
+    def _take_batch(self) -> list:
+        with self._lock:
+            all_dirty, self._all_dirty = self._all_dirty, False
+        if all_dirty:
+            with session_scope() as db:
+                user_ids = db.scalars(select(Goal.user_id).distinct()).all()
+            with self._lock:
+                self._dirty.update(user_ids)
+        with self._lock:
+            batch = [self._dirty.pop() for _ in range(min(self.batch_size, len(self._dirty)))]
+        return batch
+
+    def tick(self) -> int:
+        """Evaluate one batch of dirty users and emit events; returns the number of users evaluated."""
+        try:
+            batch = self._take_batch()
+        except Exception as e:
+            self._errors += 1
+            print(f"Goal monitor: error collecting dirty users: {e}")
+            return 0
+        if not batch:
+            return 0
+        try:
+            progress = evaluate_goals(batch)
+        except Exception as e:
+            with self._lock:
+                self._dirty.update(batch)
+            self._errors += 1
+            print(f"Goal monitor: error evaluating goals: {e}")
+            return 0
+
+        now = datetime.utcnow()
+        current = {user_id: {} for user_id in batch}
+        events = []
+        with self._lock:
+            for p in progress:
+                current[p["user_id"]][p["goal_id"]] = p["status"]
+                previous = self._statuses.get(p["user_id"], {}).get(p["goal_id"], "on_track")
+                if p["status"] != previous and p["status"] in ALERT_STATUSES:
+                    events.append({"event": p["status"], "at": now, "previous_status": previous, **p})
+            # Goals that are gone or past their deadline drop out here.
+            for user_id, statuses in current.items():
+                if statuses:
+                    self._statuses[user_id] = statuses
+                else:
+                    self._statuses.pop(user_id, None)
+        self._ticks += 1
+        self._users_evaluated += len(batch)
+        self._goals_evaluated += len(progress)
+        for event in events:
+            self._emit(event)
+        return len(batch)
+
+    def _emit(self, event: dict):
+        self._events += 1
+        for sink in self.sinks:
+            try:
+                sink(event)
+            except Exception as e:
+                self._errors += 1
+                print(f"Goal monitor: sink {sink!r} failed: {e}")
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._dirty)
+
+    def _run(self):
+        while not self._stop.is_set():
+            # Keep draining while a full batch came back; otherwise wait for the next tick.
+            if self.tick() < self.batch_size:
+                self._wake.wait(self.interval)
+                self._wake.clear()
+
+    def start(self, prime: bool = True):
+        """Subscribe, take a baseline (unless prime=False) and run ticks on a daemon thread."""
+        if self._thread is not None:
+            return
+        self.subscribe()
+        if prime:
+            self.prime()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="goal-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        """Stop the thread and stop collecting changes; pending dirty users are kept."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if self._subscribed:
+            changes.unsubscribe(self._on_change)
+            self._subscribed = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "ticks": self._ticks,
+                "users_evaluated": self._users_evaluated,
+                "goals_evaluated": self._goals_evaluated,
+                "events": self._events,
+                "errors": self._errors,
+                "pending_users": len(self._dirty),
+                "all_users_pending": self._all_dirty,
+                "tracked_goals": sum(len(statuses) for statuses in self._statuses.values()),
+            }
+
+def monitor_from_env():
+    """A GoalMonitor writing to GOAL_MONITOR_LOG and/or GOAL_MONITOR_JSONL, or None if neither is set."""
+    sinks = []
+    if os.getenv("GOAL_MONITOR_LOG"):
+        sinks.append(LogSink(os.getenv("GOAL_MONITOR_LOG")))
+    if os.getenv("GOAL_MONITOR_JSONL"):
+        sinks.append(JsonlSink(os.getenv("GOAL_MONITOR_JSONL")))
+    return GoalMonitor(sinks) if sinks else None
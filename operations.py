@@ -1,152 +1,500 @@
 from sqlalchemy.orm import Session
-from models import User, Activity, SessionLocal
-from tabulate import tabulate
+from models import User, Activity, session_scope
 from sqlalchemy.sql import func
-from models import Goal
+from sqlalchemy import insert, select, and_, or_
+from itertools import chain, islice, compress
+from operator import mul, not_
+from models import Goal, EmissionDaily
+from rollups import rollup_deltas, apply_rollup_deltas, remove_user_rollups, clear_rollups
+from factors import EMISSION_FACTORS, get_factor_index
+from units import conversion_factor, conversion_factors, resolve_unit
+from changes import record_change, log_activity_changes, log_truncate
+from cache import aggregate_cache
+from credentials import get_verifier, QueueFullError
+from throttle import get_throttle
 from datetime import datetime
-from passlib.hash import bcrypt
 import json
+import time
 import traceback
+from array import array
+from math import isfinite, isnan
+from utils import get_numpy
 
-# Emission factors dictionary (kg CO2 per unit of quantity)
-EMISSION_FACTORS = {
-    "Driving": 0.170,  # kg CO2 per km (petrol car average)
-    "Flying Domestic": 0.246,  # kg CO2 per km
-    "Flying International": 0.154,  # kg CO2 per km (short-haul)
-    "Bus": 0.089,  # kg CO2 per km
-    "Train": 0.035,  # kg CO2 per km (national rail)
-    "Electricity": 0.475,  # kg CO2 per kWh (global average)
-}
-
-def verify_user(username: str, password: str) -> bool:
-    """Verify user credentials against the database."""
-    session = SessionLocal()
+# tabulate, passlib and NumPy are imported on first use, so importing this
+# module (and starting the CLI) only pays for what a command actually needs.
+
+def tabulate(*args, **kwargs):
+    from tabulate import tabulate as render
+    return render(*args, **kwargs)
+
+# Every operation below takes an optional `session`. Without one it runs in its
+# own unit of work (open, commit, close) and reports errors by printing them.
+# With one it joins the caller's session_scope and lets errors propagate, so
+# the caller's transaction is rolled back as a whole:
+#
+#     with session_scope() as session:
+#         for row in rows:
+#             add_activity(*row, session=session)
+#         add_goal(user_id, "Commute less", 500.0, deadline, session=session)
+#         list_goals(session=session)
+
+def verify_user(username: str, password: str, source: str = None, session: Session = None) -> bool:
+    """Verify user credentials against the database.
+
+    source identifies where the attempt comes from (client address, ...) for
+    the login throttle.
+    """
+    throttle = get_throttle()
     try:
-        user = session.query(User).filter_by(username=username).first()
-        if not user:
-            print(f"No user found with username: {username}")
+        wait = throttle.retry_after(username, source)
+        if wait > 0:
+            print(f"Too many failed login attempts, try again in {wait:.0f} seconds")
             return False
-        if not hasattr(user, 'password_hash'):
-            print("Error: User model missing password_hash field")
-            return False
-        if bcrypt.verify(password, user.password_hash):
+        with session_scope(session) as db:
+            user = db.query(User).filter_by(username=username).first()
+            if not user:
+                throttle.record_failure(username, source)
+                print(f"No user found with username: {username}")
+                return False
+            if not hasattr(user, 'password_hash'):
+                print("Error: User model missing password_hash field")
+                return False
+            password_hash = user.password_hash
+        # The hash check runs on the verifier's worker pool, outside the
+        # unit of work so no connection is held while it runs.
+        started = time.perf_counter()
+        valid = get_verifier().verify(password, password_hash)
+        throttle.record_verification(time.perf_counter() - started)
+        if valid:
+            throttle.record_success(username, source)
             print(f"Login successful for {username}")
             return True
         else:
+            throttle.record_failure(username, source)
             print("Incorrect password")
             return False
+    except QueueFullError as e:
+        if session is not None:
+            raise
+        print(f"Too many logins in progress, try again shortly ({e})")
+        return False
     except Exception as e:
+        if session is not None:
+            raise
         print(f"Error verifying user: {e}")
         traceback.print_exc()
         return False
-    finally:
-        session.close()
 
-def calculate_emission(activity_type: str, quantity: float) -> float:
-    factor = EMISSION_FACTORS.get(activity_type)
+def calculate_emission(activity_type: str, quantity: float, activity_date: datetime = None) -> float:
+    """Emission for quantity using the factor in force on activity_date (default: now)."""
+    factor = get_factor_index().lookup(activity_type, activity_date)
     if factor:
         return quantity * factor
     return 0.0
 
-def add_user(username: str, password: str) -> bool:
+def calculate_emissions(activity_types, quantities, activity_dates=None):
+    """Batch version of calculate_emission over columns.
+
+    Types are resolved to factors once per distinct type and the quantities
+    are multiplied column-wise; results are identical to calling
+    calculate_emission row by row. Returns a NumPy array when quantities is
+    one, otherwise an array('d'). NumPy is used for the multiplication
+    whenever it is installed.
+    """
+    factors = get_factor_index().factors_for(activity_types, activity_dates)
+    np = get_numpy()
+    if np is not None:
+        factor_column = np.frombuffer(factors, dtype=np.float64)
+        if isinstance(quantities, array) and quantities.typecode == "d":
+            quantity_column = np.frombuffer(quantities, dtype=np.float64)
+        else:
+            quantity_column = np.asarray(quantities, dtype=np.float64)
+        emissions = np.where(factor_column != 0.0, quantity_column * factor_column, 0.0)
+        if isinstance(quantities, np.ndarray):
+            return emissions
+        result = array("d")
+        result.frombytes(emissions.tobytes())
+        return result
+    emissions = array("d", map(mul, quantities, factors))
+    # calculate_emission returns a plain 0.0 when there is no factor, even
+    # for quantities where quantity * 0.0 would give -0.0 or nan.
+    for i in compress(range(len(factors)), map(not_, factors)):
+        emissions[i] = 0.0
+    return emissions
+
+def add_user(username: str, password: str, session: Session = None) -> bool:
     """Add a new user with hashed password."""
-    session = SessionLocal()
     try:
-        if session.query(User).filter_by(username=username).first():
-            print(f"Error: Username {username} already exists.")
-            return False
-        password_hash = bcrypt.hash(password)
-        new_user = User(username=username, password_hash=password_hash)
-        session.add(new_user)
-        session.commit()
+        with session_scope(session) as db:
+            if db.query(User).filter_by(username=username).first():
+                print(f"Error: Username {username} already exists.")
+                return False
+            from passlib.hash import bcrypt
+            password_hash = bcrypt.hash(password)
+            new_user = User(username=username, password_hash=password_hash)
+            db.add(new_user)
         print(tabulate([[f"User '{username}' added!"]], tablefmt="grid"))
         return True
     except Exception as e:
-        session.rollback()
+        if session is not None:
+            raise
         print(f"Error adding user: {e}")
         traceback.print_exc()
         return False
-    finally:
-        session.close()
 
-def add_activity(user_id: int, activity_type: str, quantity: float, emission: float = None):
+def add_activity(user_id: int, activity_type: str, quantity: float, emission: float = None,
+                 unit: str = None, session: Session = None):
+    """Record an activity. quantity is in `unit` when given, else already in
+    the activity type's canonical unit (km, or kWh for Electricity)."""
     print("Add new Activity")
-    session = SessionLocal()
     try:
-        user = session.query(User).filter_by(id=user_id).first()
-        if not user:
-            print(f"No user found with ID {user_id}!\n")
-            return
-        
-        if emission is None:
-            emission = calculate_emission(activity_type, quantity)
-            if emission == 0.0:
-                print("No auto-calculation available for this activity type.")
-                return
-        
-        new_activity = Activity(
-            user_id=user_id,
-            activity_type=activity_type,
-            quantity=quantity,
-            emission=emission
-        )
-        session.add(new_activity)
-        session.commit()
+        with session_scope(session) as db:
+            user = db.query(User).filter_by(id=user_id).first()
+            if not user:
+                print(f"No user found with ID {user_id}!\n")
+                return None
+
+            source_quantity = source_unit = None
+            if unit:
+                source_quantity, source_unit = quantity, resolve_unit(unit)
+                quantity = quantity * conversion_factor(activity_type, unit)
+
+            activity_date = datetime.utcnow()
+            if emission is None:
+                emission = calculate_emission(activity_type, quantity, activity_date)
+                if emission == 0.0:
+                    print("No auto-calculation available for this activity type.")
+                    return None
+
+            new_activity = Activity(
+                user_id=user_id,
+                activity_type=activity_type,
+                quantity=quantity,
+                emission=emission,
+                source_quantity=source_quantity,
+                source_unit=source_unit,
+                activity_date=activity_date
+            )
+            db.add(new_activity)
+            apply_rollup_deltas(db, rollup_deltas([
+                (user_id, activity_type, quantity, emission, new_activity.activity_date)
+            ]))
+            record_change(db, {user_id})
         print("Activity added!\n")
+        return new_activity
     except Exception as e:
-        session.rollback()
+        if session is not None:
+            raise
         print(f"Error adding activity: {e}\n")
-    finally:
-        session.close()
+        return None
+
+BULK_CHUNK_SIZE = 5000
+# Keeps IN (...) lists well under SQLite's bound-parameter limit.
+USER_LOOKUP_CHUNK_SIZE = 500
+# In the order the compiled INSERT binds them, so rows go to the driver as built.
+BULK_COLUMNS = ("user_id", "activity_type", "quantity", "emission", "activity_date", "source_quantity", "source_unit")
+BULK_DATE_INDEX = BULK_COLUMNS.index("activity_date")
+
+def _existing_user_ids(db: Session, user_ids) -> set:
+    user_ids = list(user_ids)
+    found = set()
+    for start in range(0, len(user_ids), USER_LOOKUP_CHUNK_SIZE):
+        chunk = user_ids[start:start + USER_LOOKUP_CHUNK_SIZE]
+        found.update(db.execute(select(User.id).where(User.id.in_(chunk))).scalars())
+    return found
+
+def _insert_activity_tuples(db: Session, values: list):
+    """executemany straight on the driver cursor.
+
+    The statement is compiled once for the connection's dialect and the rows
+    are passed as plain tuples, skipping SQLAlchemy's per-row parameter
+    processing, which dominates the cost of large batches. Only the date
+    column needs converting, and distinct dates are converted once; rows are
+    otherwise passed through unchanged.
+    """
+    connection = db.connection()
+    dialect = connection.dialect
+    compiled = insert(Activity.__table__).compile(dialect=dialect, column_keys=list(BULK_COLUMNS))
+    to_db_date = Activity.__table__.c.activity_date.type.dialect_impl(dialect).bind_processor(dialect)
+    if to_db_date is not None:
+        converted = {}
+        d = BULK_DATE_INDEX
+        for i, row in enumerate(values):
+            when = row[d]
+            db_when = converted.get(when)
+            if db_when is None:
+                db_when = converted[when] = to_db_date(when)
+            values[i] = row[:d] + (db_when,) + row[d + 1:]
+    if compiled.positional:
+        order = [BULK_COLUMNS.index(name) for name in compiled.positiontup]
+        params = values if order == list(range(len(BULK_COLUMNS))) else [tuple(row[i] for i in order) for row in values]
+    else:
+        params = [dict(zip(BULK_COLUMNS, row)) for row in values]
+    connection.exec_driver_sql(compiled.string, params)
+
+def add_activities_bulk(rows, chunk_size: int = BULK_CHUNK_SIZE, session: Session = None) -> dict:
+    """Insert many activities at once.
+
+    Each row is a mapping with user_id, activity_type and a positive quantity, plus
+    optional unit, emission and activity_date. All referenced users are
+    checked in one pass, quantities with a unit are converted to the
+    canonical unit and emissions computed for the whole batch, and rows are
+    inserted with executemany in chunks of chunk_size. Without a session each
+    chunk is committed separately; with one, nothing is committed here.
+
+    Returns {"inserted": n, "rejected": [(row_index, reason), ...]}; every row
+    not listed as rejected was inserted.
+    """
+    rows = list(rows)
+    report = {"inserted": 0, "rejected": []}
+    if not rows:
+        return report
+
+    with session_scope(session) as db:
+        known_users = _existing_user_ids(db, {row.get("user_id") for row in rows})
+
+    now = datetime.utcnow()
+    rejected = report["rejected"]
+    indexes = []
+    values = []
+    for index, row in enumerate(rows):
+        user_id = row.get("user_id")
+        activity_type = row.get("activity_type")
+        quantity = row.get("quantity")
+        if user_id not in known_users:
+            rejected.append((index, f"unknown user_id {user_id}"))
+            continue
+        if not activity_type:
+            rejected.append((index, "missing activity_type"))
+            continue
+        if isinstance(quantity, bool) or not isinstance(quantity, (int, float)) or not isfinite(quantity):
+            rejected.append((index, f"invalid quantity {quantity!r}"))
+            continue
+        if quantity <= 0:
+            rejected.append((index, f"quantity must be positive, got {quantity!r}"))
+            continue
+        indexes.append(index)
+        # BULK_COLUMNS order; the unit sits in source_unit until it is converted.
+        values.append((user_id, activity_type, quantity, row.get("emission"), row.get("activity_date") or now,
+                       None, row.get("unit") or None))
+
+    dropped = set()
+    with_units = [i for i, value in enumerate(values) if value[6]]
+    if with_units:
+        factors = conversion_factors([values[i][1] for i in with_units], [values[i][6] for i in with_units])
+        for i, factor in zip(with_units, factors):
+            user_id, activity_type, quantity, emission, activity_date, _, unit = values[i]
+            if isnan(factor):
+                dropped.add(i)
+                rejected.append((indexes[i], f"cannot convert {unit!r} for {activity_type!r}"))
+            else:
+                values[i] = (user_id, activity_type, quantity * factor, emission, activity_date, quantity,
+                             resolve_unit(unit))
+
+    missing = [i for i, value in enumerate(values) if value[3] is None and i not in dropped]
+    if missing:
+        emissions = calculate_emissions(
+            [values[i][1] for i in missing], [values[i][2] for i in missing], [values[i][4] for i in missing]
+        )
+        for i, emission in zip(missing, emissions):
+            if emission == 0.0:
+                dropped.add(i)
+                rejected.append((indexes[i], f"no emission factor for {values[i][1]!r}"))
+            else:
+                values[i] = values[i][:3] + (emission,) + values[i][4:]
+
+    if dropped:
+        indexes = [index for i, index in enumerate(indexes) if i not in dropped]
+        values = [value for i, value in enumerate(values) if i not in dropped]
+        rejected.sort()
 
-def list_activities():
+    for start in range(0, len(values), chunk_size):
+        chunk = values[start:start + chunk_size]
+        try:
+            deltas = rollup_deltas(value[:5] for value in chunk)
+            with session_scope(session) as db:
+                _insert_activity_tuples(db, chunk)
+                apply_rollup_deltas(db, deltas)
+                record_change(db, {value[0] for value in chunk})
+            report["inserted"] += len(chunk)
+        except Exception as e:
+            if session is not None:
+                raise
+            rejected.extend((index, f"database error: {e}") for index in indexes[start:start + chunk_size])
+    return report
+
+LIST_PAGE_SIZE = 1000
+LIST_COLUMNS = ["ID", "Activity Type", "User", "Emission", "Date"]
+
+def _activity_listing_query(user_id: int = None, activity_type: str = None,
+                            start: datetime = None, end: datetime = None, after: tuple = None):
+    """Activities joined to their username in (activity_date, id) order.
+
+    after is the (activity_date, id) of the last row already seen; only rows
+    past it are returned (keyset pagination).
+    """
+    query = (
+        select(Activity.id, Activity.activity_type, func.coalesce(User.username, "Unknown"),
+               Activity.emission, Activity.activity_date)
+        .outerjoin(User, User.id == Activity.user_id)
+        .order_by(Activity.activity_date, Activity.id)
+    )
+    if user_id is not None:
+        query = query.where(Activity.user_id == user_id)
+    if activity_type:
+        query = query.where(Activity.activity_type == activity_type)
+    if start is not None:
+        query = query.where(Activity.activity_date >= start)
+    if end is not None:
+        query = query.where(Activity.activity_date < end)
+    if after is not None:
+        after_date, after_id = after
+        query = query.where(or_(
+            Activity.activity_date > after_date,
+            and_(Activity.activity_date == after_date, Activity.id > after_id),
+        ))
+    return query
+
+def list_activities_page(user_id: int = None, activity_type: str = None, start: datetime = None,
+                         end: datetime = None, after: tuple = None, limit: int = LIST_PAGE_SIZE,
+                         session: Session = None):
+    """Return (rows, next_after) for one page of activities.
+
+    Pass next_after back as `after` to fetch the following page; it is None
+    once the last page has been returned.
+    """
+    with session_scope(session) as db:
+        query = _activity_listing_query(user_id, activity_type, start, end, after).limit(limit)
+        rows = db.execute(query).all()
+    next_after = (rows[-1][4], rows[-1][0]) if len(rows) == limit else None
+    return rows, next_after
+
+def iter_activities(user_id: int = None, activity_type: str = None, start: datetime = None,
+                    end: datetime = None, after: tuple = None, batch_size: int = LIST_PAGE_SIZE,
+                    session: Session = None):
+    """Stream (id, activity_type, username, emission, activity_date) rows.
+
+    Runs a single query and fetches it batch_size rows at a time, so memory
+    stays constant however many activities match. Rows come straight from the
+    Core connection, without the ORM's per-row result wrapping.
+    """
+    with session_scope(session) as db:
+        query = _activity_listing_query(user_id, activity_type, start, end, after)
+        yield from db.connection().execute(query.execution_options(yield_per=batch_size))
+
+def list_activities(user_id: int = None, activity_type: str = None, start: datetime = None,
+                    end: datetime = None, limit: int = None, session: Session = None):
     print("Activities")
-    session = SessionLocal()
     try:
-        activities = session.query(Activity).all()
-        if not activities:
+        rows = iter_activities(user_id, activity_type, start, end, session=session)
+        if limit is not None:
+            rows = islice(rows, limit)
+        shown = 0
+        while True:
+            table = list(islice(rows, LIST_PAGE_SIZE))
+            if not table:
+                break
+            print(tabulate(table, headers=LIST_COLUMNS, tablefmt="grid"))
+            shown += len(table)
+        if not shown:
             print("No activities found!\n")
             return
-        table = []
-        for a in activities:
-            user = session.query(User).filter_by(id=a.user_id).first()
-            username = user.username if user else "Unknown"
-            table.append([a.id, a.activity_type, username, a.emission, a.activity_date])
-        print(tabulate(table, headers=["ID", "Activity Type", "User", "Emission", "Date"], tablefmt="grid"))
         print()
     except Exception as e:
+        if session is not None:
+            raise
         print(f"Error listing activities: {e}\n")
-    finally:
-        session.close()
 
-def list_users():
+def list_users(session: Session = None):
     print("Users")
-    session = SessionLocal()
     try:
-        users = session.query(User).all()
-        if not users:
-            print("No users found!\n")
-            return
-        table = []
-        for u in users:
-            table.append([u.id, u.username, u.created_at])
+        with session_scope(session) as db:
+            users = db.query(User).all()
+            if not users:
+                print("No users found!\n")
+                return
+            table = []
+            for u in users:
+                table.append([u.id, u.username, u.created_at])
         print(tabulate(table, headers=["ID", "Username", "Created At"], tablefmt="grid"))
         print()
     except Exception as e:
+        if session is not None:
+            raise
         print(f"Error listing users: {e}\n")
-    finally:
-        session.close()
 
-def display_emissions_bar_chart():
+# Aggregates below read the emissions_daily rollup and are cached in
+# aggregate_cache, keyed by their parameters and the data version of the
+# users involved. Calls made inside a caller's session bypass the cache, as
+# that session may hold uncommitted writes.
+
+def _cached(name: str, params: tuple, compute, session: Session = None, user_id: int = None):
+    if session is not None:
+        return compute(session)
+    def run():
+        with session_scope() as db:
+            return compute(db)
+    return aggregate_cache.get_or_compute(name, params, run, user_id=user_id)
+
+def get_user_totals(user_id: int, start: datetime = None, end: datetime = None, session: Session = None) -> dict:
+    """Total quantity, emission and activity count for one user, optionally
+    limited to days in [start, end)."""
+    def compute(db):
+        query = db.query(
+            func.coalesce(func.sum(EmissionDaily.total_quantity), 0.0),
+            func.coalesce(func.sum(EmissionDaily.total_emission), 0.0),
+            func.coalesce(func.sum(EmissionDaily.count), 0),
+        ).filter(EmissionDaily.user_id == user_id)
+        if start is not None:
+            query = query.filter(EmissionDaily.day >= start.date())
+        if end is not None:
+            query = query.filter(EmissionDaily.day < end.date())
+        quantity, emission, count = query.one()
+        return {"total_quantity": quantity, "total_emission": emission, "count": count}
+    return _cached("user_totals", (user_id, start, end), compute, session, user_id)
+
+def get_type_breakdown(user_id: int = None, start: datetime = None, end: datetime = None,
+                       session: Session = None) -> list:
+    """(activity_type, total_emission, count) per type, largest emitter first,
+    for one user or for everyone."""
+    def compute(db):
+        query = db.query(
+            EmissionDaily.activity_type,
+            func.sum(EmissionDaily.total_emission).label("total_emission"),
+            func.sum(EmissionDaily.count),
+        )
+        if user_id is not None:
+            query = query.filter(EmissionDaily.user_id == user_id)
+        if start is not None:
+            query = query.filter(EmissionDaily.day >= start.date())
+        if end is not None:
+            query = query.filter(EmissionDaily.day < end.date())
+        rows = query.group_by(EmissionDaily.activity_type).order_by(func.sum(EmissionDaily.total_emission).desc())
+        return [(activity_type or None, emission, count) for activity_type, emission, count in rows]
+    return _cached("type_breakdown", (user_id, start, end), compute, session, user_id)
+
+def get_leaderboard(limit: int = None, start: datetime = None, end: datetime = None,
+                    session: Session = None) -> list:
+    """(user_id, username, total_emission) per user with activities, highest first."""
+    def compute(db):
+        query = (
+            db.query(User.id, User.username, func.sum(EmissionDaily.total_emission).label("total_emission"))
+            .join(EmissionDaily, User.id == EmissionDaily.user_id)
+        )
+        if start is not None:
+            query = query.filter(EmissionDaily.day >= start.date())
+        if end is not None:
+            query = query.filter(EmissionDaily.day < end.date())
+        query = query.group_by(User.id, User.username).order_by(func.sum(EmissionDaily.total_emission).desc(), User.id)
+        if limit is not None:
+            query = query.limit(limit)
+        return [tuple(row) for row in query]
+    return _cached("leaderboard", (limit, start, end), compute, session)
+
+def display_emissions_bar_chart(session: Session = None):
     print("Total Emissions by User (Bar Chart)")
-    session = SessionLocal()
     try:
-        results = (
-            session.query(User.username, func.sum(Activity.emission).label("total_emission"))
-            .join(Activity, User.id == Activity.user_id)
-            .group_by(User.id)
-            .all()
-        )
+        results = [(username, total) for _, username, total in get_leaderboard(session=session)]
         if not results:
             print("No activities found to display!\n")
             return
@@ -164,114 +512,125 @@ def display_emissions_bar_chart():
         print(tabulate(table, headers=["Username", "Total Emission (kg CO2)", "Bar"], tablefmt="grid"))
         print()
     except Exception as e:
+        if session is not None:
+            raise
         print(f"Error generating bar chart: {e}\n")
-    finally:
-        session.close()
 
-def delete_user(user_id: int):
+def delete_user(user_id: int, session: Session = None):
     print("Delete User")
-    session = SessionLocal()
     try:
-        user = session.query(User).filter_by(id=user_id).first()
-        if not user:
-            print(f"No user found with ID {user_id}!\n")
-            return
-        session.delete(user)
-        session.commit()
+        with session_scope(session) as db:
+            user = db.query(User).filter_by(id=user_id).first()
+            if not user:
+                print(f"No user found with ID {user_id}!\n")
+                return
+            remove_user_rollups(db, user_id)
+            log_activity_changes(db, "delete", Activity.user_id == user_id)
+            db.delete(user)
+            record_change(db, {user_id})
         print(f"User ID {user_id} and associated activities deleted!\n")
     except Exception as e:
-        session.rollback()
+        if session is not None:
+            raise
         print(f"Error deleting user: {e}\n")
-    finally:
-        session.close()
 
-def get_all_users():
-    session = SessionLocal()
+def get_all_users(session: Session = None):
     try:
-        users = session.query(User).all()
-        return users
+        with session_scope(session) as db:
+            return db.query(User).all()
     except Exception as e:
+        if session is not None:
+            raise
         print(f"Error retrieving users: {e}\n")
         return []
-    finally:
-        session.close()
 
-def add_goal(user_id: int, description: str, target_emission: float, deadline: datetime):
-    session = SessionLocal()
+def add_goal(user_id: int, description: str, target_emission: float, deadline: datetime,
+             start_date: datetime = None, session: Session = None):
+    """Add a goal; emissions count towards it from start_date (default: now)."""
     try:
-        new_goal = Goal(
-            user_id=user_id,
-            description=description,
-            target_emission=target_emission,
-            deadline=deadline
-        )
-        session.add(new_goal)
-        session.commit()
+        with session_scope(session) as db:
+            new_goal = Goal(
+                user_id=user_id,
+                description=description,
+                target_emission=target_emission,
+                start_date=start_date or datetime.utcnow(),
+                deadline=deadline
+            )
+            db.add(new_goal)
+            # Lets the goal monitor evaluate the new goal without waiting for an activity.
+            record_change(db, {user_id})
         print("Goal added!\n")
+        return new_goal
     except Exception as e:
-        session.rollback()
+        if session is not None:
+            raise
         print(f"Error adding goal: {e}\n")
-    finally:
-        session.close()
+        return None
 
-def list_goals():
-    session = SessionLocal()
+GOAL_COLUMNS = ["ID", "User ID", "Description", "Target", "Accrued", "Used %", "Projected", "Overshoot", "Status", "Deadline"]
+
+def goal_progress_rows(progress) -> list:
+    return [
+        (p["goal_id"], p["user_id"], p["description"], f"{p['target_emission']:.2f}", f"{p['accrued_emission']:.2f}",
+         "" if p["percent_used"] is None else f"{p['percent_used']:.1f}", f"{p['projected_emission']:.2f}", f"{p['projected_overshoot']:.2f}", p["status"],
+         p["deadline"].strftime('%Y-%m-%d') if p["deadline"] else "")
+        for p in progress
+    ]
+
+def list_goals(session: Session = None):
+    from goals import evaluate_goals
     try:
-        goals = session.query(Goal).all()
-        if not goals:
+        progress = evaluate_goals(include_expired=True, session=session)
+        if not progress:
             print("No goals found!\n")
             return
-        table = [(g.id, g.user_id, g.description, g.target_emission, g.deadline.strftime('%Y-%m-%d')) for g in goals]
-        print(tabulate(table, headers=["ID", "User ID", "Description", "Target Emission", "Deadline"], tablefmt="grid"))
+        print(tabulate(goal_progress_rows(progress), headers=GOAL_COLUMNS, tablefmt="grid"))
         print()
     except Exception as e:
+        if session is not None:
+            raise
         print(f"Error listing goals: {e}\n")
-    finally:
-        session.close()
 
-def delete_all_activities():
+def delete_all_activities(session: Session = None):
     print("Delete All Activities")
-    session = SessionLocal()
     try:
-        deleted = session.query(Activity).delete()
-        session.commit()
+        with session_scope(session) as db:
+            log_truncate(db)
+            deleted = db.query(Activity).delete()
+            clear_rollups(db)
+            record_change(db)
         print(tabulate([[f"Deleted {deleted} activities!"]], tablefmt="grid"))
     except Exception as e:
-        session.rollback()
+        if session is not None:
+            raise
         print(f"Error deleting activities: {e}\n")
-    finally:
-        session.close()
 
-def export_activities_to_json(username: str, filename: str = "emissions.json"):
-    """Export a user's activities to a JSON file."""
-    session = SessionLocal()
+def export_activities_to_json(username: str, filename: str = "emissions.json", session: Session = None):
+    """Export a user's activities to a JSON file as {"username", "activities": [...]}.
+
+    Activities are streamed from the database (see export.py), so memory use
+    does not grow with the number of activities.
+    """
+    from export import export_query, open_output, write_rows
     try:
-        user = session.query(User).filter_by(username=username).first()
-        if not user:
-            print(f"No user found with username {username}!\n")
-            return
-        activities = session.query(Activity).filter_by(user_id=user.id).all()
-        if not activities:
-            print(f"No activities found for user {username}!\n")
-            return
-        
-        data = {
-            "username": username,
-            "activities": [
-                {
-                    "id": a.id,
-                    "activity_type": a.activity_type,
-                    "quantity": a.quantity,
-                    "emission": a.emission,
-                    "date": a.activity_date.strftime("%Y-%m-%d %H:%M:%S")
-                } for a in activities
-            ]
-        }
-        
-        with open(filename, "w") as f:
-            json.dump(data, f, indent=4)
-        print(f"Activities exported to {filename} successfully!\n")
+        with session_scope(session) as db:
+            user = db.query(User).filter_by(username=username).first()
+            if not user:
+                print(f"No user found with username {username}!\n")
+                return
+            query = export_query(("id", "activity_type", "quantity", "emission", "activity_date"), user_id=user.id)
+            rows = db.connection().execute(query.execution_options(yield_per=LIST_PAGE_SIZE))
+            # Look at the first row before creating the file: no activities, no file.
+            first = next(rows, None)
+            if first is None:
+                print(f"No activities found for user {username}!\n")
+                return
+            with open_output(filename, compress=False) as f:
+                f.write(f'{{"username":{json.dumps(username)},"activities":')
+                count = write_rows(f, ("id", "activity_type", "quantity", "emission", "date"), chain((first,), rows), "json")
+                f.write("}\n")
+        print(f"{count} activities exported to {filename} successfully!\n")
     except Exception as e:
+        if session is not None:
+            raise
         print(f"Error exporting activities to JSON: {e}\n")
-    finally:
-        session.close()
\ No newline at end of file
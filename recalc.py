@@ -0,0 +1,141 @@
+"""Recalculate stored emissions after an emission factor changes.
+
+Activities of one type (optionally within a date window) are re-priced with
+the factors currently in the emission_factors table. The work runs as a
+series of set-based UPDATE ... WHERE id BETWEEN lo AND hi statements, each in
+its own short transaction that also corrects emissions_daily and advances
+the job's checkpoint. Concurrent ingestion therefore waits for at most one
+chunk, and an interrupted job continues from the last committed chunk.
+
+Manually entered emissions of the same type are re-priced too.
+
+    python recalc.py Bus --start 2024-01-01 --end 2025-01-01
+"""
+import argparse
+import time
+from datetime import datetime
+from sqlalchemy import and_, case, func, select, update
+from models import Activity, Checkpoint, session_scope
+from factors import get_factor_index, reload_factor_index
+from rollups import apply_rollup_deltas, day_of
+from changes import record_change, log_activity_changes
+
+DEFAULT_CHUNK_SIZE = 10000
+
+def job_name(activity_type: str, start: datetime = None, end: datetime = None) -> str:
+    return f"recalc:{activity_type}:{start or ''}:{end or ''}"
+
+def _emission_expression(activity_type: str):
+    """CASE expression pricing a row with the factor in force on its date.
+
+    Rows outside every factor interval keep their current emission. Returns
+    None when the type has no factors at all.
+    """
+    whens = []
+    for valid_from, valid_to, factor in get_factor_index().intervals(activity_type):
+        bounds = []
+        if valid_from is not None:
+            bounds.append(Activity.activity_date >= valid_from)
+        if valid_to is not None:
+            bounds.append(Activity.activity_date < valid_to)
+        whens.append((and_(True, *bounds), Activity.quantity * factor))
+    if not whens:
+        return None
+    return case(*whens, else_=Activity.emission)
+
+def _emission_totals(db, dialect_name: str, filters) -> dict:
+    day = day_of(dialect_name, Activity.activity_date)
+    rows = db.execute(
+        select(Activity.user_id, day, func.coalesce(func.sum(Activity.emission), 0.0))
+        .where(*filters)
+        .group_by(Activity.user_id, day)
+    ).all()
+    return {(user_id, day): total for user_id, day, total in rows}
+
+def recalculate_emissions(activity_type: str, start: datetime = None, end: datetime = None,
+                          chunk_size: int = DEFAULT_CHUNK_SIZE, restart: bool = False) -> dict:
+    """Re-price activities of activity_type dated in [start, end).
+
+    Returns {"updated": rows changed this run, "chunks": chunks committed}.
+    """
+    reload_factor_index()
+    new_emission = _emission_expression(activity_type)
+    if new_emission is None:
+        print(f"No emission factor registered for {activity_type}; nothing to recalculate.\n")
+        return {"updated": 0, "chunks": 0}
+
+    filters = [Activity.activity_type == activity_type]
+    if start is not None:
+        filters.append(Activity.activity_date >= start)
+    if end is not None:
+        filters.append(Activity.activity_date < end)
+
+    name = job_name(activity_type, start, end)
+    with session_scope() as session:
+        checkpoint = session.get(Checkpoint, name)
+        if checkpoint is None:
+            checkpoint = Checkpoint(name=name, position=0, batches=0, rows=0)
+            session.add(checkpoint)
+        elif restart:
+            checkpoint.position = checkpoint.batches = checkpoint.rows = 0
+        resume_after = checkpoint.position
+        first_id, last_id = session.execute(
+            select(func.min(Activity.id), func.max(Activity.id)).where(*filters, Activity.id > resume_after)
+        ).one()
+
+    totals = {"updated": 0, "chunks": 0}
+    if first_id is None:
+        print(f"No {activity_type} activities left to recalculate.\n")
+    else:
+        if resume_after:
+            print(f"Resuming recalculation of {activity_type} after activity ID {resume_after}")
+        started = time.perf_counter()
+        for lo in range(first_id, last_id + 1, chunk_size):
+            hi = min(lo + chunk_size - 1, last_id)
+            chunk_filters = filters + [Activity.id.between(lo, hi)]
+            changed = Activity.emission.is_distinct_from(new_emission)
+            with session_scope() as session:
+                dialect_name = session.get_bind().dialect.name
+                before = _emission_totals(session, dialect_name, chunk_filters)
+                log_activity_changes(session, "update", *chunk_filters, changed)
+                result = session.execute(
+                    update(Activity).where(*chunk_filters, changed).values(emission=new_emission)
+                    .execution_options(synchronize_session=False)
+                )
+                after = _emission_totals(session, dialect_name, chunk_filters)
+                apply_rollup_deltas(session, {
+                    (user_id, activity_type, day): [0.0, after[(user_id, day)] - before.get((user_id, day), 0.0), 0]
+                    for user_id, day in after
+                })
+                record_change(session, {user_id for user_id, _ in after})
+                checkpoint = session.get(Checkpoint, name)
+                checkpoint.position = hi
+                checkpoint.batches += 1
+                checkpoint.rows += result.rowcount
+
+            totals["updated"] += result.rowcount
+            totals["chunks"] += 1
+            done = (hi - first_id + 1) / (last_id - first_id + 1) * 100
+            elapsed = time.perf_counter() - started
+            print(f"Chunk {totals['chunks']}: IDs up to {hi} ({done:.1f}%), "
+                  f"{totals['updated']} rows updated, {totals['updated'] / elapsed if elapsed else 0:.0f} rows/s")
+
+    with session_scope() as session:
+        checkpoint = session.get(Checkpoint, name)
+        if checkpoint is not None:
+            session.delete(checkpoint)
+    print(f"Recalculation of {activity_type} complete: {totals['updated']} rows updated.\n")
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description="Recalculate stored emissions for an activity type")
+    parser.add_argument("activity_type")
+    parser.add_argument("--start", type=datetime.fromisoformat, help="first activity date to include (YYYY-MM-DD)")
+    parser.add_argument("--end", type=datetime.fromisoformat, help="first activity date to exclude (YYYY-MM-DD)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--restart", action="store_true", help="ignore any saved progress and start over")
+    args = parser.parse_args()
+    recalculate_emissions(args.activity_type, args.start, args.end, args.chunk_size, args.restart)
+
+if __name__ == "__main__":
+    main()
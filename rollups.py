@@ -0,0 +1,95 @@
+from collections import defaultdict
+from sqlalchemy import delete, func, insert, select, update, cast, type_coerce, Date
+from sqlalchemy.orm import Session
+from models import Activity, EmissionDaily
+
+# emissions_daily holds one row per (user_id, activity_type, day) with the
+# summed quantity and emission and the number of activities. Every write path
+# in operations.py applies its change here in the same transaction, so reports
+# can read these rows instead of scanning activities.
+
+ROLLUP = EmissionDaily.__table__
+
+def day_of(dialect_name: str, column):
+    """SQL expression truncating a DateTime column to its day."""
+    if dialect_name == "sqlite":
+        return type_coerce(func.date(column), Date)
+    return cast(column, Date)
+
+def rollup_deltas(values) -> dict:
+    """Sum (user_id, activity_type, quantity, emission, activity_date) tuples per rollup key."""
+    deltas = defaultdict(lambda: [0.0, 0.0, 0])
+    for user_id, activity_type, quantity, emission, activity_date in values:
+        delta = deltas[(user_id, activity_type or "", activity_date.date())]
+        delta[0] += quantity or 0.0
+        delta[1] += emission or 0.0
+        delta[2] += 1
+    return deltas
+
+def _upsert(session: Session, params: list):
+    dialect = session.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        statement = dialect_insert(ROLLUP)
+        statement = statement.on_conflict_do_update(
+            index_elements=[ROLLUP.c.user_id, ROLLUP.c.activity_type, ROLLUP.c.day],
+            set_={
+                "total_quantity": ROLLUP.c.total_quantity + statement.excluded.total_quantity,
+                "total_emission": ROLLUP.c.total_emission + statement.excluded.total_emission,
+                "count": ROLLUP.c.count + statement.excluded.count,
+            },
+        )
+        session.execute(statement, params)
+        return
+
+    for row in params:
+        result = session.execute(
+            update(ROLLUP)
+            .where(ROLLUP.c.user_id == row["user_id"], ROLLUP.c.activity_type == row["activity_type"],
+                   ROLLUP.c.day == row["day"])
+            .values(total_quantity=ROLLUP.c.total_quantity + row["total_quantity"],
+                    total_emission=ROLLUP.c.total_emission + row["total_emission"],
+                    count=ROLLUP.c.count + row["count"])
+        )
+        if result.rowcount == 0:
+            session.execute(insert(ROLLUP), row)
+
+def apply_rollup_deltas(session: Session, deltas: dict):
+    """Add per-key (quantity, emission, count) deltas to emissions_daily."""
+    if not deltas:
+        return
+    _upsert(session, [
+        {"user_id": user_id, "activity_type": activity_type, "day": day,
+         "total_quantity": quantity, "total_emission": emission, "count": count}
+        for (user_id, activity_type, day), (quantity, emission, count) in deltas.items()
+    ])
+
+def remove_user_rollups(session: Session, user_id: int):
+    session.execute(delete(ROLLUP).where(ROLLUP.c.user_id == user_id))
+
+def clear_rollups(session: Session):
+    session.execute(delete(ROLLUP))
+
+def rebuild_rollups(connection):
+    """Recompute emissions_daily from scratch in one INSERT ... SELECT."""
+    day = day_of(connection.dialect.name, Activity.activity_date)
+    activity_type = func.coalesce(Activity.activity_type, "")
+    totals = (
+        select(
+            Activity.user_id,
+            activity_type,
+            day,
+            func.coalesce(func.sum(Activity.quantity), 0.0),
+            func.coalesce(func.sum(Activity.emission), 0.0),
+            func.count(),
+        )
+        .where(Activity.user_id.is_not(None), Activity.activity_date.is_not(None))
+        .group_by(Activity.user_id, activity_type, day)
+    )
+    connection.execute(delete(ROLLUP))
+    connection.execute(insert(ROLLUP).from_select(
+        ["user_id", "activity_type", "day", "total_quantity", "total_emission", "count"], totals
+    ))
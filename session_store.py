@@ -0,0 +1,179 @@
+"""Signed, expiring login sessions.
+
+A token carries its session id, expiry and username and is signed with
+HMAC-SHA256 under SESSION_SECRET, so a forged or expired token is rejected
+without any lookup. Valid tokens are then checked against the session
+records, which live in an in-process cache; any number of sessions can be
+open at once.
+
+With SESSION_STORE_BACKEND=database the records are also kept in the
+auth_sessions table so several processes share them. Cache entries are then
+re-read from the table after SESSION_CACHE_TTL seconds, which bounds how
+long a logout in another process takes to be noticed. All processes sharing
+the table need the same SESSION_SECRET; without one a random secret is
+generated per process.
+
+SESSION_TTL sets how long a session lasts (seconds, default 12 hours).
+Expired sessions are purged every SESSION_PURGE_INTERVAL seconds (600).
+"""
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import delete
+from models import AuthSession, session_scope
+
+DEFAULT_SESSION_TTL = float(os.getenv("SESSION_TTL", 12 * 3600))
+DEFAULT_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", 60))
+DEFAULT_PURGE_INTERVAL = float(os.getenv("SESSION_PURGE_INTERVAL", 600))
+
+def _encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+def _decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+class SessionStore:
+    def __init__(self, secret: str = None, ttl: float = DEFAULT_SESSION_TTL,
+                 persist: bool = False, cache_ttl: float = DEFAULT_CACHE_TTL,
+                 purge_interval: float = DEFAULT_PURGE_INTERVAL):
+        secret = secret or os.getenv("SESSION_SECRET")
+        if not secret:
+            if persist:
+                print("Warning: SESSION_SECRET is not set; sessions will not be valid in other processes.")
+            secret = secrets.token_hex(32)
+        self._key = secret.encode("utf-8")
+        self.ttl = ttl
+        self.persist = persist
+        self.cache_ttl = cache_ttl
+        self.purge_interval = purge_interval
+        self._next_purge = time.time() + purge_interval
+        # session id -> (username, expires_at epoch, re-check time epoch)
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._stats = {"created": 0, "resolved": 0, "rejected": 0, "cache_hits": 0, "cache_misses": 0}
+
+    def _sign(self, payload: str) -> str:
+        return _encode(hmac.new(self._key, payload.encode("ascii"), hashlib.sha256).digest())
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _maybe_purge(self):
+        """Run purge_expired at most once per purge_interval, so expired sessions do not pile up."""
+        now = time.time()
+        with self._lock:
+            if now < self._next_purge:
+                return
+            self._next_purge = now + self.purge_interval
+        self.purge_expired()
+
+    def create(self, username: str) -> str:
+        """Open a session for username and return its token."""
+        self._maybe_purge()
+        session_id = secrets.token_urlsafe(16)
+        expires_at = int(time.time() + self.ttl)
+        payload = f"{session_id}.{expires_at}.{_encode(username.encode('utf-8'))}"
+        if self.persist:
+            with session_scope() as db:
+                db.add(AuthSession(id=session_id, username=username,
+                                   expires_at=datetime.utcfromtimestamp(expires_at)))
+        with self._lock:
+            self._cache[session_id] = (username, expires_at, time.time() + self.cache_ttl)
+            self._stats["created"] += 1
+        return f"{payload}.{self._sign(payload)}"
+
+    def _parse(self, token: str):
+        """(session_id, username, expires_at) of a well-signed, unexpired token, else None."""
+        try:
+            payload, signature = token.rsplit(".", 1)
+            # Bytes, since compare_digest refuses non-ASCII str.
+            if not hmac.compare_digest(signature.encode("utf-8"), self._sign(payload).encode("ascii")):
+                return None
+            session_id, expires_at, username = payload.split(".")
+            expires_at = int(expires_at)
+            username = _decode(username).decode("utf-8")
+        except (AttributeError, ValueError, UnicodeError):
+            return None
+        if expires_at <= time.time():
+            return None
+        return session_id, username, expires_at
+
+    def resolve(self, token: str) -> str:
+        """Username of the session behind token, or None if it is invalid, expired or revoked."""
+        self._maybe_purge()
+        parsed = self._parse(token) if token else None
+        if parsed is None:
+            self._count("rejected")
+            return None
+        session_id, username, expires_at = parsed
+        now = time.time()
+        with self._lock:
+            entry = self._cache.get(session_id)
+        if entry is not None and (not self.persist or entry[2] > now):
+            self._count("cache_hits")
+        else:
+            self._count("cache_misses")
+            entry = None
+            if self.persist:
+                with session_scope() as db:
+                    record = db.get(AuthSession, session_id)
+                    if record is not None:
+                        entry = (record.username, expires_at, now + self.cache_ttl)
+            with self._lock:
+                if entry is not None:
+                    self._cache[session_id] = entry
+                else:
+                    self._cache.pop(session_id, None)
+        if entry is None or entry[0] != username:
+            self._count("rejected")
+            return None
+        self._count("resolved")
+        return username
+
+    def revoke(self, token: str):
+        """End the session behind token (log out)."""
+        parsed = self._parse(token) if token else None
+        if parsed is None:
+            return
+        session_id = parsed[0]
+        with self._lock:
+            self._cache.pop(session_id, None)
+        if self.persist:
+            with session_scope() as db:
+                db.execute(delete(AuthSession).where(AuthSession.id == session_id))
+
+    def purge_expired(self) -> int:
+        """Drop expired sessions from the cache (and table); returns how many cached ones went."""
+        now = time.time()
+        with self._lock:
+            expired = [session_id for session_id, entry in self._cache.items() if entry[1] <= now]
+            for session_id in expired:
+                del self._cache[session_id]
+        if self.persist:
+            with session_scope() as db:
+                db.execute(delete(AuthSession).where(AuthSession.expires_at <= datetime.utcfromtimestamp(now)))
+        return len(expired)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, cached=len(self._cache))
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_session_store() -> SessionStore:
+    """The process-wide store; SESSION_STORE_BACKEND=database persists sessions."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            backend = os.getenv("SESSION_STORE_BACKEND", "memory").lower()
+            if backend not in ("memory", "database"):
+                raise ValueError(f"unknown SESSION_STORE_BACKEND {backend!r}; expected memory or database")
+            _store = SessionStore(persist=backend == "database")
+        return _store
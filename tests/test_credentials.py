@@ -0,0 +1,37 @@
+import os
+import signal
+import unittest
+from passlib.hash import bcrypt
+from credentials import CredentialVerifier
+
+HASH = bcrypt.using(rounds=4).hash("secret")
+
+def kill_workers(verifier: CredentialVerifier):
+    for process in list(verifier._executor._processes.values()):
+        os.kill(process.pid, signal.SIGKILL)
+        process.join()
+
+class BrokenPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.verifier = CredentialVerifier(workers=1, max_pending=4)
+
+    def tearDown(self):
+        self.verifier.shutdown()
+
+    def test_recovers_after_idle_worker_is_killed(self):
+        self.assertTrue(self.verifier.verify("secret", HASH, timeout=30))
+        kill_workers(self.verifier)
+        self.assertTrue(self.verifier.verify("secret", HASH, timeout=30))
+        self.assertFalse(self.verifier.verify("wrong", HASH, timeout=30))
+        self.assertEqual(self.verifier.stats()["pool_restarts"], 1)
+
+    def test_retries_check_whose_worker_died(self):
+        self.assertTrue(self.verifier.verify("secret", HASH, timeout=30))
+        slow_hash = bcrypt.using(rounds=14).hash("secret")
+        future = self.verifier.submit("secret", slow_hash)
+        kill_workers(self.verifier)
+        self.assertTrue(future.result(timeout=60))
+        self.assertEqual(self.verifier.stats()["pending"], 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import math
+import unittest
+from datetime import datetime
+from factors import FactorIndex
+from importer import normalize_records
+from units import conversion_factors
+
+def normalize(record: dict):
+    [(_, row, error)] = normalize_records([(0, record)])
+    return row, error
+
+class ActivityDateTest(unittest.TestCase):
+    def test_naive_date_is_kept(self):
+        row, error = normalize({"user_id": "1", "activity_type": "Car", "quantity": "10",
+                                "activity_date": "2024-03-01T23:30:00"})
+        self.assertIsNone(error)
+        self.assertEqual(row["activity_date"], datetime(2024, 3, 1, 23, 30))
+
+    def test_offset_date_becomes_naive_utc(self):
+        row, error = normalize({"user_id": "1", "activity_type": "Car", "quantity": "10",
+                                "activity_date": "2024-03-01T23:30:00-02:00"})
+        self.assertIsNone(error)
+        self.assertEqual(row["activity_date"], datetime(2024, 3, 2, 1, 30))
+        self.assertIsNone(row["activity_date"].tzinfo)
+
+    def test_offset_date_looks_up_dated_factor(self):
+        index = FactorIndex([("Bus", 0.1, None, datetime(2024, 3, 2)),
+                             ("Bus", 0.08, datetime(2024, 3, 2), None)])
+        row, _ = normalize({"user_id": "1", "activity_type": "Bus", "quantity": "10",
+                            "activity_date": "2024-03-01T23:30:00-02:00"})
+        self.assertEqual(index.lookup(row["activity_type"], row["activity_date"]), 0.08)
+
+class UnitTest(unittest.TestCase):
+    def test_non_string_unit_is_rejected(self):
+        row, error = normalize({"user_id": 1, "activity_type": "Car", "quantity": 3, "unit": 5})
+        self.assertIsNone(row)
+        self.assertIn("unit must be a string", error)
+
+    def test_non_string_unit_has_no_conversion(self):
+        self.assertTrue(math.isnan(conversion_factors(["Car"], [5])[0]))
+
+if __name__ == "__main__":
+    unittest.main()
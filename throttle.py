@@ -0,0 +1,173 @@
+"""Sliding-window throttle for failed logins.
+
+Failures are counted per username and per source (client address, terminal,
+...) over the last LOGIN_THROTTLE_WINDOW seconds. Once either count reaches
+its limit, further attempts on that key are refused before any password
+hashing happens, until enough failures have aged out of the window. A
+successful login clears the username's failures.
+
+The default backend keeps the windows in process memory. Deployments running
+several processes set LOGIN_THROTTLE_BACKEND=database to share them through
+the login_failures table.
+
+Limits: LOGIN_THROTTLE_MAX_USER_FAILURES (default 5),
+LOGIN_THROTTLE_MAX_SOURCE_FAILURES (20), LOGIN_THROTTLE_WINDOW (900).
+Every LOGIN_THROTTLE_SWEEP_INTERVAL seconds (60) a failure also drops the
+expired failures of every key, so guessing many usernames once each does not
+grow the backend without bound.
+"""
+import os
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from sqlalchemy import delete, select
+from models import LoginFailure, session_scope
+
+DEFAULT_MAX_USER_FAILURES = int(os.getenv("LOGIN_THROTTLE_MAX_USER_FAILURES", 5))
+DEFAULT_MAX_SOURCE_FAILURES = int(os.getenv("LOGIN_THROTTLE_MAX_SOURCE_FAILURES", 20))
+DEFAULT_WINDOW_SECONDS = float(os.getenv("LOGIN_THROTTLE_WINDOW", 900))
+DEFAULT_SWEEP_INTERVAL = float(os.getenv("LOGIN_THROTTLE_SWEEP_INTERVAL", 60))
+
+class _Backend:
+    def __init__(self, sweep_interval: float = DEFAULT_SWEEP_INTERVAL):
+        self.sweep_interval = timedelta(seconds=sweep_interval)
+        self._next_sweep = datetime.min
+        self._sweep_lock = threading.Lock()
+
+    def _sweep_due(self, when: datetime) -> bool:
+        """True at most once per sweep_interval, when every key's expired failures should go."""
+        with self._sweep_lock:
+            if when < self._next_sweep:
+                return False
+            self._next_sweep = when + self.sweep_interval
+            return True
+
+class MemoryBackend(_Backend):
+    """Failure timestamps per key in this process."""
+
+    def __init__(self, sweep_interval: float = DEFAULT_SWEEP_INTERVAL):
+        super().__init__(sweep_interval)
+        self._failures = {}
+        self._lock = threading.Lock()
+
+    def failures(self, key: str, since: datetime) -> list:
+        with self._lock:
+            times = self._failures.get(key)
+            if times is None:
+                return []
+            while times and times[0] < since:
+                times.popleft()
+            if not times:
+                del self._failures[key]
+                return []
+            return list(times)
+
+    def add(self, key: str, when: datetime, since: datetime):
+        sweep = self._sweep_due(when)
+        with self._lock:
+            if sweep:
+                # The newest failure is last, so a key whose last one is stale is entirely stale.
+                for stale in [k for k, times in self._failures.items() if times[-1] < since]:
+                    del self._failures[stale]
+            times = self._failures.setdefault(key, deque())
+            while times and times[0] < since:
+                times.popleft()
+            times.append(when)
+
+    def clear(self, key: str):
+        with self._lock:
+            self._failures.pop(key, None)
+
+class DatabaseBackend(_Backend):
+    """Failure timestamps in the login_failures table, shared by all processes."""
+
+    def failures(self, key: str, since: datetime) -> list:
+        with session_scope() as db:
+            return list(db.scalars(
+                select(LoginFailure.attempted_at)
+                .where(LoginFailure.key == key, LoginFailure.attempted_at >= since)
+                .order_by(LoginFailure.attempted_at)
+            ))
+
+    def add(self, key: str, when: datetime, since: datetime):
+        stale = LoginFailure.attempted_at < since
+        if not self._sweep_due(when):
+            stale = stale & (LoginFailure.key == key)
+        with session_scope() as db:
+            db.execute(delete(LoginFailure).where(stale))
+            db.add(LoginFailure(key=key, attempted_at=when))
+
+    def clear(self, key: str):
+        with session_scope() as db:
+            db.execute(delete(LoginFailure).where(LoginFailure.key == key))
+
+BACKENDS = {"memory": MemoryBackend, "database": DatabaseBackend}
+
+class LoginThrottle:
+    def __init__(self, backend=None, max_user_failures: int = DEFAULT_MAX_USER_FAILURES,
+                 max_source_failures: int = DEFAULT_MAX_SOURCE_FAILURES,
+                 window: float = DEFAULT_WINDOW_SECONDS):
+        self.backend = backend or MemoryBackend()
+        self.max_user_failures = max_user_failures
+        self.max_source_failures = max_source_failures
+        self.window = timedelta(seconds=window)
+        self._lock = threading.Lock()
+        self._stats = {"allowed": 0, "blocked": 0, "failures": 0, "verify_seconds": 0.0, "verifications": 0}
+
+    def _keys(self, username: str, source: str = None):
+        yield f"user:{username}", self.max_user_failures
+        if source:
+            yield f"source:{source}", self.max_source_failures
+
+    def retry_after(self, username: str, source: str = None) -> float:
+        """Seconds until an attempt for (username, source) is allowed; 0 if it is now."""
+        now = datetime.utcnow()
+        since = now - self.window
+        wait = 0.0
+        for key, limit in self._keys(username, source):
+            times = self.backend.failures(key, since)
+            if len(times) >= limit:
+                # The attempt is allowed once enough failures have left the window.
+                freed_at = times[len(times) - limit] + self.window
+                wait = max(wait, (freed_at - now).total_seconds())
+        with self._lock:
+            self._stats["blocked" if wait > 0 else "allowed"] += 1
+        return wait
+
+    def record_failure(self, username: str, source: str = None):
+        now = datetime.utcnow()
+        for key, _ in self._keys(username, source):
+            self.backend.add(key, now, now - self.window)
+        with self._lock:
+            self._stats["failures"] += 1
+
+    def record_success(self, username: str, source: str = None):
+        self.backend.clear(f"user:{username}")
+
+    def record_verification(self, seconds: float):
+        """Note how long a password check took, for the CPU-saved estimate."""
+        with self._lock:
+            self._stats["verify_seconds"] += seconds
+            self._stats["verifications"] += 1
+
+    def stats(self) -> dict:
+        """Counters plus cpu_seconds_saved: blocked attempts times the mean check time."""
+        with self._lock:
+            stats = dict(self._stats)
+        mean = stats["verify_seconds"] / stats["verifications"] if stats["verifications"] else 0.0
+        stats["cpu_seconds_saved"] = stats["blocked"] * mean
+        return stats
+
+_throttle = None
+_throttle_lock = threading.Lock()
+
+def get_throttle() -> LoginThrottle:
+    """The process-wide throttle, using the backend named by LOGIN_THROTTLE_BACKEND."""
+    global _throttle
+    with _throttle_lock:
+        if _throttle is None:
+            backend = os.getenv("LOGIN_THROTTLE_BACKEND", "memory").lower()
+            if backend not in BACKENDS:
+                raise ValueError(f"unknown LOGIN_THROTTLE_BACKEND {backend!r}; expected one of {', '.join(BACKENDS)}")
+            _throttle = LoginThrottle(BACKENDS[backend]())
+        return _throttle
@@ -0,0 +1,132 @@
+from array import array
+from math import nan
+
+# Every activity type has one canonical unit; Activity.quantity is always
+# stored in it, so emission factors and aggregates never convert at query
+# time. Quantities arriving in other units are converted once at ingest and
+# the original quantity and unit are kept on the activity.
+
+CANONICAL_UNITS = {
+    "Driving": "km",
+    "Flying Domestic": "km",
+    "Flying International": "km",
+    "Bus": "km",
+    "Train": "km",
+    "Electricity": "kWh",
+}
+
+# unit -> (dimension, size in the dimension's base unit)
+UNITS = {
+    "km": ("distance", 1.0),
+    "m": ("distance", 0.001),
+    "mi": ("distance", 1.609344),
+    "kWh": ("energy", 1.0),
+    "Wh": ("energy", 0.001),
+    "MWh": ("energy", 1000.0),
+    "MJ": ("energy", 1 / 3.6),
+    "GJ": ("energy", 1000 / 3.6),
+    "therm": ("energy", 29.30711),  # 105.5 MJ (EC/UK therm)
+    "L": ("fuel", 1.0),
+    "gal": ("fuel", 3.785411784),  # US gallon
+}
+
+ALIASES = {
+    "kilometre": "km", "kilometres": "km", "kilometer": "km", "kilometers": "km",
+    "metre": "m", "metres": "m", "meter": "m", "meters": "m",
+    "mile": "mi", "miles": "mi",
+    "therms": "therm", "thm": "therm",
+    "l": "L", "litre": "L", "litres": "L", "liter": "L", "liters": "L",
+    "gallon": "gal", "gallons": "gal",
+}
+
+# Fuel bought for driving is converted to the distance it covers.
+DRIVING_KM_PER_LITRE = 100 / 7.0  # average petrol car, 7 L/100 km
+
+BASE_UNITS = {"distance": "km", "energy": "kWh", "fuel": "L"}
+
+class UnitError(ValueError):
+    pass
+
+def canonical_unit(activity_type: str, unit: str = None) -> str:
+    """Unit quantities of activity_type are stored in.
+
+    Types without a registered unit use the base unit of the incoming unit's
+    dimension, or no unit at all.
+    """
+    if activity_type in CANONICAL_UNITS:
+        return CANONICAL_UNITS[activity_type]
+    symbol = resolve_unit(unit) if unit else None
+    return BASE_UNITS[UNITS[symbol][0]] if symbol else None
+
+def resolve_unit(unit: str) -> str:
+    """Canonical symbol for a unit name or alias (case-insensitive)."""
+    if not isinstance(unit, str):
+        raise UnitError(f"unit must be a string, not {unit!r}")
+    if unit in UNITS:
+        return unit
+    key = unit.strip()
+    for candidate in (key, key.lower()):
+        if candidate in UNITS:
+            return candidate
+        if candidate in ALIASES:
+            return ALIASES[candidate]
+    for symbol in UNITS:
+        if symbol.lower() == key.lower():
+            return symbol
+    raise UnitError(f"unknown unit {unit!r}")
+
+def _build_conversions() -> dict:
+    conversions = {}
+    for activity_type, target in CANONICAL_UNITS.items():
+        target_dimension, target_size = UNITS[target]
+        for symbol, (dimension, size) in UNITS.items():
+            if dimension == target_dimension:
+                conversions[(activity_type, symbol)] = size / target_size
+    for symbol, (dimension, size) in UNITS.items():
+        if dimension == "fuel":
+            conversions[("Driving", symbol)] = size * DRIVING_KM_PER_LITRE
+    return conversions
+
+# (activity_type, unit symbol) -> multiplier into the canonical unit,
+# precomputed once so ingest only does a dict lookup and a multiply.
+CONVERSIONS = _build_conversions()
+
+def conversion_factor(activity_type: str, unit: str = None) -> float:
+    """Multiplier turning a quantity in `unit` into activity_type's canonical unit."""
+    if not unit:
+        return 1.0
+    symbol = resolve_unit(unit)
+    factor = CONVERSIONS.get((activity_type, symbol))
+    if factor is not None:
+        return factor
+    if activity_type not in CANONICAL_UNITS:
+        return UNITS[symbol][1]
+    raise UnitError(f"cannot convert {unit} to {CANONICAL_UNITS[activity_type]} for {activity_type}")
+
+def normalize_quantity(activity_type: str, quantity: float, unit: str = None):
+    """Return (quantity in canonical unit, canonical unit)."""
+    return quantity * conversion_factor(activity_type, unit), canonical_unit(activity_type, unit)
+
+def conversion_factors(activity_types, units) -> array:
+    """Per-row multipliers as array('d'), resolved once per distinct (type, unit).
+
+    Rows whose unit is unknown or incompatible get nan.
+    """
+    resolved = {}
+    factors = array("d")
+    append = factors.append
+    for key in zip(activity_types, units):
+        factor = resolved.get(key)
+        if factor is None:
+            try:
+                factor = conversion_factor(*key)
+            except UnitError:
+                factor = nan
+            resolved[key] = factor
+        append(factor)
+    return factors
+
+def normalize_quantities(activity_types, quantities, units) -> array:
+    """Convert a whole quantity column to canonical units (nan where impossible)."""
+    factors = conversion_factors(activity_types, units)
+    return array("d", [quantity * factor for quantity, factor in zip(quantities, factors)])
@@ -0,0 +1,27 @@
+"""Small helpers shared by the CLI, the data layer and the goal monitor.
+
+Only the standard library is imported here, so the CLI can use these
+without slowing its startup; NumPy is imported on the first get_numpy() call.
+"""
+from datetime import datetime
+
+np = None
+_numpy_checked = False
+
+def get_numpy():
+    """NumPy if it is installed, else None; imported on first call."""
+    global np, _numpy_checked
+    if not _numpy_checked:
+        _numpy_checked = True
+        try:
+            import numpy
+            np = numpy
+        except ImportError:
+            pass
+    return np
+
+def json_default(value):
+    """json.dumps fallback: ISO 8601 for datetimes, str() for anything else."""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)